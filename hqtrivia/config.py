@@ -1,6 +1,7 @@
-import json
 import logging
 
+from . import jsoncodec
+
 """
 Serves as the global configuration for the hqtrivia package.
 """
@@ -9,37 +10,38 @@ CONFIG_LOG_LEVEL = logging.INFO
 CONFIG_PLAYERS_PER_GAME = 2
 CONFIG_WS_SERVER_PORT = 9999
 CONFIG_ROUND_DURATION = 10
-CONFIG_QUESTION_GENERATOR_API = 'http://opentdb.com/api.php?amount=1&type=multiple&difficulty=easy'
+CONFIG_QUESTION_GENERATOR_API = 'http://opentdb.com/api.php?amount=10&type=multiple&difficulty=easy'
+# Set only when the server is behind a reverse proxy that sets X-Forwarded-For
+CONFIG_TRUST_PROXY_HEADERS = False
+
+
+# Maps the keys in the JSON config file to the global variables in this module
+CONFIG_KEY_TO_GLOBAL = {
+    'log_level': 'CONFIG_LOG_LEVEL',
+    'players_per_game': 'CONFIG_PLAYERS_PER_GAME',
+    'ws_server_port': 'CONFIG_WS_SERVER_PORT',
+    'round_duration': 'CONFIG_ROUND_DURATION',
+    'question_generator_api': 'CONFIG_QUESTION_GENERATOR_API',
+    'trust_proxy_headers': 'CONFIG_TRUST_PROXY_HEADERS',
+}
 
 
 def load_config(config_file: str):
     """Loads JSON config file into the global variables in this module.
+    Unknown keys in the config file are ignored.
 
     Parameters
     ----------
     config_file: str
         Configuration file path
     """
-    global CONFIG_LOG_LEVEL
-    global CONFIG_PLAYERS_PER_GAME
-    global CONFIG_WS_SERVER_PORT
-    global CONFIG_ROUND_DURATION
-    global CONFIG_QUESTION_GENERATOR_API
-
     with open(config_file) as config_file:
-        data = json.load(config_file)
-
-        if ('log_level' in data):
-            CONFIG_LOG_LEVEL = data['log_level']
-
-        if ('players_per_game' in data):
-            CONFIG_PLAYERS_PER_GAME = data['players_per_game']
+        data = jsoncodec.loads(config_file.read())
 
-        if ('ws_server_port' in data):
-            CONFIG_WS_SERVER_PORT = data['ws_server_port']
+    module_globals = globals()
 
-        if ('round_duration' in data):
-            CONFIG_ROUND_DURATION = data['round_duration']
+    for key, value in data.items():
+        name = CONFIG_KEY_TO_GLOBAL.get(key)
 
-        if ('question_generator_api' in data):
-            CONFIG_QUESTION_GENERATOR_API = data['question_generator_api']
+        if (name != None):
+            module_globals[name] = value
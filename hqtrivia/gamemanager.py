@@ -1,5 +1,8 @@
+from aiohttp import ClientSession
+from aiohttp import TCPConnector
 import argparse
 import asyncio
+from collections import deque
 import logging
 import websockets
 
@@ -7,6 +10,7 @@ import hqtrivia.config as config
 from .gamesession import GameSession
 from .messages import *
 from .player import Player
+from .question import QuestionPool
 from .websocketserver import WebsocketServer
 from .websocketserver import WebsocketCallbackInterface
 
@@ -36,7 +40,7 @@ class GameManager(WebsocketCallbackInterface):
     Events are driven by the call from the websocketserver when a new websocket
     is connected.  Websocket is abstracted by wrapping it in the Player instance.
     The Player is then put on the waiting list. If the waiting list meets the
-    minimum number of players, a GameSession is created and is run using await.
+    minimum number of players, a GameSession is created and is run as a separate task.
 
     All Player instances wait on a future instance so that the underly websocket
     connection is kept alive until the game is over for the Player. The future
@@ -46,17 +50,40 @@ class GameManager(WebsocketCallbackInterface):
 
     def __init__(self):
         # Players waiting for the game to start after quorum is reached
-        self.waiting_players = []
+        self.waiting_players = deque()
         self.next_game_id = 1
+        # Keep references to the running games so that the tasks are not garbage collected
+        self.game_tasks = set()
+        # HTTP client session and the pool of questions shared by all games. Created when the
+        # server starts since they have to be created within the event loop.
+        self.http_session = None
+        self.question_pool = None
         self.wsserver = WebsocketServer(config.CONFIG_WS_SERVER_PORT, self)
 
     def main(self):
         """Start websocket server and wait forever
         """
 
-        event_loop = asyncio.get_event_loop()
-        event_loop.run_until_complete(self.wsserver.start())
-        event_loop.run_forever()
+        asyncio.run(self.main_async())
+
+    async def main_async(self):
+        """Start websocket server and wait forever on the running event loop
+        """
+
+        # Keep the connections to the trivia server alive so that they are reused for the questions
+        self.http_session = ClientSession(
+            connector=TCPConnector(limit=32, ttl_dns_cache=300))
+        self.question_pool = QuestionPool(self.http_session)
+
+        try:
+            await self.wsserver.start()
+
+            # Nothing ever sets this event. The server runs until the event loop is stopped.
+            await asyncio.Event().wait()
+        finally:
+            self.question_pool = None
+            await self.http_session.close()
+            self.http_session = None
 
     async def handle_new_websocket(self, websocket: websockets.WebSocketServerProtocol):
         """Callback from the websocketserver to handle a new websocket.
@@ -83,31 +110,60 @@ class GameManager(WebsocketCallbackInterface):
             Player who just connected to the server
         """
 
+        players_per_game = config.CONFIG_PLAYERS_PER_GAME
+
         # Create future to await on and queue onto the waiting list
         self.waiting_players.append(player)
 
         # If there is a quorum, create a new game and schedule it as a task
-        if (len(self.waiting_players) >= config.CONFIG_PLAYERS_PER_GAME):
-            game = GameSession(self.next_game_id, self.waiting_players)
-            self.next_game_id += 1
-
+        if (len(self.waiting_players) >= players_per_game):
+            # Snapshot the waiting players so that the game does not alias the waiting list
+            players = list(self.waiting_players)
             self.waiting_players.clear()
 
-            # Use the last player's context to run the game.
-            await game.run()
+            game = GameSession(self.next_game_id, players, self.question_pool)
+            self.next_game_id += 1
+
+            # Run the game as its own task so that the game does not depend on the
+            # websocket handler of the player who completed the quorum.
+            task = asyncio.create_task(game.run())
+            self.game_tasks.add(task)
+            task.add_done_callback(self.handle_game_task_done)
         else:
             logging.info(
-                f"Waiting for more players: [players={len(self.waiting_players)} min_required={config.CONFIG_PLAYERS_PER_GAME}]")
-            await player.send_announcement(TEMPLATE_WAITING_FOR_PLAYERS.substitute(players=config.CONFIG_PLAYERS_PER_GAME))
+                "Waiting for more players: [players=%s min_required=%s]", len(self.waiting_players), players_per_game)
+            await player.send_announcement(TEMPLATE_WAITING_FOR_PLAYERS.substitute(players=players_per_game))
 
-        # Wait until the game is complete for this player
-        await player.future
+        try:
+            # Wait until the game is complete for this player
+            await player.future
+
+            # Make sure the last messages reach the player before the websocket is closed
+            await player.finish_sending()
+        finally:
+            # Writer would otherwise be left waiting for messages forever if this handler is
+            # cancelled, e.g. when the server shuts down.
+            player.stop_sending()
+
+    def handle_game_task_done(self, task: asyncio.Task):
+        """Callback from the asyncio when the game task is done.
+
+        Parameters
+        ----------
+        task: asyncio.Task
+            Task that ran the game
+        """
+        self.game_tasks.discard(task)
+
+        # Retrieve the exception so that asyncio does not complain about it.
+        # It is already logged by GameSession.run().
+        if (not task.cancelled()):
+            task.exception()
 
 
 if __name__ == '__main__':
     """main execution entry for the hqtrivia package
     """
-
     parser = argparse.ArgumentParser()
     parser.add_argument('--config', metavar='path',
                         required=False, help='path to the config.json file')
@@ -121,6 +177,13 @@ if __name__ == '__main__':
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s',
                         level=config.CONFIG_LOG_LEVEL)
 
+    # uvloop is a faster drop-in replacement for the default event loop. Use it if installed.
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        logging.info("uvloop is not installed. Using the default event loop.")
+
     try:
         gm = GameManager()
         gm.main()
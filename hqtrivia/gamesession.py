@@ -1,6 +1,4 @@
 import asyncio
-from collections import Counter
-import json
 import logging
 from typing import List
 import websockets
@@ -10,6 +8,7 @@ import hqtrivia.config as config
 from .messages import *
 from .player import Player
 from .question import Question
+from .question import QuestionPool
 
 """
 Runs a single game session and manages the message exchanges with the players in the game.
@@ -38,10 +37,24 @@ class GameSession:
     Please see the Player documentation for the message sequence between the server and client.
     """
 
-    def __init__(self, game_id: int, players: List[Player]):
+    def __init__(self, game_id: int, players: List[Player], question_pool: QuestionPool = None):
+        """
+        Parameters
+        ----------
+        game_id: int
+            Unique id of this game
+        players: List[Player]
+            Players in this game
+        question_pool: QuestionPool
+            Pool of questions shared by the games. If None, each question is generated on its own.
+        """
         self.game_id = game_id
+        self.question_pool = question_pool
         self.players = players.copy()
         self.current_round = 0
+        self.round_duration = config.CONFIG_ROUND_DURATION
+        # Question for the next round is generated while the players answer the current one
+        self.next_question_task = None
 
     async def run(self):
         """Drives the main logic of 1 game session instance by repeatedly calling
@@ -49,7 +62,7 @@ class GameSession:
         """
 
         logging.info(
-            f"Game has started: [game_id={self.game_id}, players={str(self.players)}]")
+            "Game has started: [game_id=%s, players=%s]", self.game_id, self.players)
 
         try:
             # Continue going to the next round as long as there's a player not eliminated yet
@@ -60,15 +73,37 @@ class GameSession:
                 gameid=self.game_id), exc_info=True)
             await self.abort_game()
             raise
+        finally:
+            self.cancel_next_question()
+
+    def cancel_next_question(self):
+        """Cancels the prefetch of the next question since the game is over. If the question
+        has already been taken from the question pool, it is put back.
+        """
+        task = self.next_question_task
+        self.next_question_task = None
+
+        if (task == None):
+            return
+
+        if (not task.done()):
+            task.cancel()
+            return
+
+        # Retrieve the exception so that asyncio does not complain about it.
+        if (task.cancelled() or task.exception() != None):
+            return
+
+        # The prefetched question was never asked, so it goes back to the shared pool for
+        # the other games instead of being thrown away.
+        if (self.question_pool != None):
+            self.question_pool.put_back(task.result())
 
     async def abort_game(self):
         """
         Aborts the game if an unrecoverable error is encountered
         """
-        await asyncio.gather(
-            *[player.send_announcement(MESSAGE_NETWORK_ERROR_OCCURRED)
-              for player in self.players]
-        )
+        await Player.broadcast_announcement(self.players, MESSAGE_NETWORK_ERROR_OCCURRED)
 
         self.handle_eliminated_players(self.players)
         self.players.clear()
@@ -80,10 +115,18 @@ class GameSession:
         self.current_round += 1
 
         logging.info(
-            f"Executing round: [game_id={self.game_id} round={self.current_round}]")
+            "Executing round: [game_id=%s round=%s]", self.game_id, self.current_round)
+
+        # Generate the question for this round unless it has been prefetched already
+        if (self.next_question_task == None):
+            self.next_question_task = asyncio.create_task(
+                self.generate_question())
 
-        # Generate the question for this round
-        question = await Question.generate()
+        question = await self.next_question_task
+
+        # Prefetch the question for the next round so that the players do not have to
+        # wait for the question generation in between the rounds.
+        self.next_question_task = asyncio.create_task(self.generate_question())
 
         # Start the duration for receiving now so that question
         # generation time is not taken into the timeout for the
@@ -92,16 +135,21 @@ class GameSession:
         # Broadcast questions to the players and wait for the answers
         answers = await self.broadcast_question_and_wait_for_answers(question)
 
-        # Broadcast the result to the players
-        eliminated_players = await self.broadcast_results_and_eliminate_players(question, answers)
-
-        # Eliminate players with wrong answers
-        self.handle_eliminated_players(eliminated_players)
+        # Broadcast the result to the players and eliminate players with wrong answers
+        await self.broadcast_results_and_eliminate_players(question, answers)
 
         # If only 1 remaining, notify the winner.
         # Return true if game should continue
         return await self.notify_winner_if_one_remaining()
 
+    async def generate_question(self) -> Question:
+        """Returns the question for a round from the question pool if there is one.
+        """
+        if (self.question_pool == None):
+            return await Question.generate()
+
+        return await self.question_pool.get()
+
     async def broadcast_question_and_wait_for_answers(self, question: Question) -> List[str]:
         """Sends the question to all players and waits for the
         answers from each players with a configured timeout.
@@ -117,57 +165,82 @@ class GameSession:
         """
 
         logging.info(
-            f"Sending questions players: [game_id={self.game_id} round={self.current_round} players={len(self.players)} question={str(question)}]")
+            "Sending questions players: [game_id=%s round=%s players=%s question=%s]",
+            self.game_id, self.current_round, len(self.players), question)
+
+        # Announce that the round is starting. It is the same message for everyone.
+        await Player.broadcast_announcement(self.players, TEMPLATE_GAME_ROUND_STARTING.substitute(
+            round=self.current_round))
+
+        # Send the question to all players first. Sending only queues the question for the
+        # writer task of each player, so the players are already written to in parallel
+        # without a task per player here.
+        sent = [await self.send_question(question, player) for player in self.players]
+
+        # Wait for the answers using a single timeout for the whole round rather than
+        # scheduling a separate timer for each player.
+        answers = [None] * len(self.players)
+        recv_tasks = dict()
+
+        # Look up the running loop once rather than once per player in asyncio.create_task()
+        create_task = asyncio.get_running_loop().create_task
+
+        for i in range(0, len(self.players)):
+            if (sent[i]):
+                recv_tasks[create_task(self.players[i].recv_answer())] = i
 
-        return await asyncio.gather(
-            *[self.send_question_and_get_answer(
-                question, player) for player in self.players]
-        )
+        if (len(recv_tasks) == 0):
+            return answers
 
-    async def send_question_and_get_answer(self, question: str, player: Player) -> str:
-        """Sends the question to one player and receives the answer with a configured timeout.
+        (done, pending) = await asyncio.wait(recv_tasks.keys(), timeout=self.round_duration)
+
+        for task in pending:
+            task.cancel()
+            logging.info(
+                "player did not respond within timeout: [player=%s timeout=%s]",
+                self.players[recv_tasks[task]], self.round_duration)
+
+        for task in done:
+            player = self.players[recv_tasks[task]]
+
+            if (task.exception() != None):
+                logging.error(
+                    "Error occurred while receiving answer: [player=%s]", player, exc_info=task.exception())
+            else:
+                answers[recv_tasks[task]] = task.result()
+                logging.info(
+                    "Player answered: [player=%s answer=%s]", player, task.result())
+
+        return answers
+
+    async def send_question(self, question: Question, player: Player) -> bool:
+        """Sends the question to one player.
 
         Parameters
         ----------
         question: Question
             Question to send to the players
         player: Player
-            Player to send the question and receive the answer from
+            Player to send the question to
 
         Returns
         -------
-        Returns the answer provided by the player. None is returned if player did not provide
-        an answer within the timeout.
+        Returns True if the question was sent. False if the player has been evicted.
         """
-        try:
-            # Announce that the round is starting
-            await player.send_announcement(TEMPLATE_GAME_ROUND_STARTING.substitute(round=self.current_round))
-            # Send the questions
-            await player.send_question(question)
-            # Give the player the round duration amount of time to answer
-            answer = await asyncio.wait_for(player.recv_answer(), timeout=config.CONFIG_ROUND_DURATION)
-            logging.info(f"Player answered: [player={player} answer={answer}]")
-            return answer
-
-        except asyncio.TimeoutError as e:
-            logging.info(
-                f"player did not respond within timeout: [player={player} timeout={config.CONFIG_ROUND_DURATION}]")
-            pass
+        if (await player.send_question(question)):
+            return True
 
-        except:
-            logging.error(
-                f"Error occurred while sending and receiving answer: [player={player}]", exc_info=True)
+        logging.error(
+            "Question could not be sent to the evicted player: [player=%s]", player)
 
-        return None
+        return False
 
-    async def broadcast_results(self, allplayers: List[Player], survivors: List[Player], eliminated: List[Player], question: Question, choice_counts: List[int]):
+    async def broadcast_results(self, survivors: List[Player], eliminated: List[Player], question: Question, choice_counts: List[int]):
         """Sends the answer statistics and the result to all players.  The statistics is the number of players who picked
         each of the answers.  The result is whether they have correctly chosen the answer or not.
 
         Parameters
         ----------
-        allplayers: List[Player]
-            All players to send to
         survivors: List[Player]
             All players who correctly answered
         eliminated: List[Player]
@@ -179,26 +252,26 @@ class GameSession:
         """
 
         logging.info(
-            f"Sending round stats to players: [game_id={self.game_id} round={self.current_round} players={len(self.players)}, counts={choice_counts}]")
-
-        # Broadcast the statistics on how many players have chosen each answer.
-        await asyncio.gather(
-            *[player.send_answers(question, choice_counts) for player in allplayers]
-        )
+            "Sending round stats to players: [game_id=%s round=%s players=%s, counts=%s]",
+            self.game_id, self.current_round, len(self.players), choice_counts)
 
         logging.info(
-            f"Game round survivors: [game_id={self.game_id} round={self.current_round} players={survivors}]")
-
-        # Broadcast whether each player has survived or been eliminated from the game.
-        coroutines = [player.send_announcement(
-            MESSAGE_CORRECT_ANSWER) for player in survivors]
-        coroutines.extend([player.send_announcement(
-            MESSAGE_YOU_ARE_ELIMINATED) for player in eliminated])
-
-        await asyncio.gather(*coroutines)
+            "Game round survivors: [game_id=%s round=%s players=%s]",
+            self.game_id, self.current_round, survivors)
+
+        # Broadcast the statistics and whether each player has survived or been eliminated
+        # from the game. Both are sent in a single message, which is identical for all
+        # survivors and for all eliminated players. Broadcasts only queue the messages
+        # without waiting on the sockets, so there is nothing to gain from running them
+        # concurrently.
+        await Player.broadcast_round_result(
+            survivors, question, choice_counts, MESSAGE_CORRECT_ANSWER)
+        await Player.broadcast_round_result(
+            eliminated, question, choice_counts, MESSAGE_YOU_ARE_ELIMINATED)
 
     async def broadcast_results_and_eliminate_players(self, question: Question, answers: List[str]) -> List[Player]:
-        """Sends the results and returns the players who have been eliminated from the game.
+        """Sends the results, removes the players who have been eliminated from the game, and
+        releases their websocket connections.
 
         Parameters
         ----------
@@ -212,33 +285,36 @@ class GameSession:
         Returns a list of players who were eliminated
         """
 
-        counter = Counter()
+        # Map each choice to its index once so that the counts can be gathered in a single pass.
+        choice_to_index = {choice: i for i, choice in enumerate(question.choices)}
+        correct_index = choice_to_index[question.answer]
+        choice_counts = [0] * len(question.choices)
         eliminated = []
         survivors = []
 
-        for i in range(0, len(self.players)):
-            if (question.answer == answers[i]):
-                # More efficient to construct new players than deleting from array list each time.
-                survivors.append(self.players[i])
-            else:
-                eliminated.append(self.players[i])
+        for (player, answer) in zip(self.players, answers):
+            # Answer not in the choices (including None for no answer) is counted nowhere
+            index = choice_to_index.get(answer, -1)
 
-            # Gather the number of players who chose this answer
-            counter[answers[i]] += 1
+            if (index >= 0):
+                choice_counts[index] += 1
 
-        choice_counts = [0] * len(question.choices)
-
-        # Convert the counter into the ordered array of counts
-        for i in range(0, len(question.choices)):
-            choice_counts[i] = counter[question.choices[i]]
+            if (index == correct_index):
+                # More efficient to construct new players than deleting from array list each time.
+                survivors.append(player)
+            else:
+                eliminated.append(player)
 
         # Send the results to the players
-        await self.broadcast_results(self.players, survivors,
-                                     eliminated, question, choice_counts)
+        await self.broadcast_results(survivors, eliminated, question, choice_counts)
 
         # Update the new players list to only the survivors
         self.players = survivors
 
+        # Eliminated players are released only after the results are sent. Otherwise their
+        # websocket connections can be closed before they receive the results.
+        self.handle_eliminated_players(eliminated)
+
         return eliminated
 
     def handle_eliminated_players(self, players: List[Player]):
@@ -251,12 +327,16 @@ class GameSession:
         players: List[Player]
             Players to be notified of elimination
         """
-        # Set the result so that the websocket handling can finish.
         for player in players:
             logging.info(
-                f"Player eliminated from the game: [game_id={self.game_id} round={self.current_round} player={player}]")
+                "Player eliminated from the game: [game_id=%s round=%s player=%s]",
+                self.game_id, self.current_round, player)
 
-            player.future.set_result(None)
+        # Set the result so that the websocket handling can finish. The future can already be
+        # done if the game is aborted right after the player has been released.
+        for player in players:
+            if (not player.future.done()):
+                player.future.set_result(None)
 
     async def notify_winner_if_one_remaining(self):
         """If there is a single player remaining, notify to the player that they have won and
@@ -269,11 +349,14 @@ class GameSession:
         """
         # Check if there's a winner
         if (len(self.players) == 1):
-            await self.players[0].send_announcement(MESSAGE_YOU_ARE_THE_WINNER)
+            winner = self.players[0]
+            await winner.send_announcement(MESSAGE_YOU_ARE_THE_WINNER)
 
-            # Notify that this player is done with the game
-            self.players[0].future.set_result(None)
-            del self.players[0]
+            # Notify that this player is done with the game. Winner stays in the list until
+            # then so that abort_game() can still release them if the announcement fails.
+            winner.future.set_result(None)
+            self.players.clear()
+            return False
 
         # Game will continue if there are still participants left
-        return len(self.players) != 0
+        return len(self.players) > 1
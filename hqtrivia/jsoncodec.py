@@ -0,0 +1,66 @@
+import json
+
+"""
+Provides the JSON encoder and decoder used throughout the hqtrivia package.
+
+orjson is used when it is installed since it is considerably faster than the
+standard library json module. Otherwise the standard library json module is
+used with the same compact output format so that the messages on the wire are
+identical regardless of which implementation is used.
+"""
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if (orjson != None):
+    def dumps(obj) -> str:
+        """Serializes obj into a compact JSON text.
+
+        Parameters
+        ----------
+        obj:
+            Object to serialize
+
+        Returns
+        -------
+        Returns the JSON text as str so that it can be sent as a websocket text frame.
+        """
+        # orjson produces UTF-8 bytes. Decoding is still cheaper than encoding using json.
+        return orjson.dumps(obj).decode('utf-8')
+
+    def loads(text):
+        """Deserializes JSON text(str or bytes) into python objects.
+
+        Parameters
+        ----------
+        text: str or bytes
+            JSON text to deserialize
+        """
+        return orjson.loads(text)
+else:
+    def dumps(obj) -> str:
+        """Serializes obj into a compact JSON text.
+
+        Parameters
+        ----------
+        obj:
+            Object to serialize
+
+        Returns
+        -------
+        Returns the JSON text as str so that it can be sent as a websocket text frame.
+        """
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+    def loads(text):
+        """Deserializes JSON text(str or bytes) into python objects.
+
+        Parameters
+        ----------
+        text: str or bytes
+            JSON text to deserialize
+        """
+        return json.loads(text)
@@ -1,16 +1,69 @@
 import asyncio
-import json
+import functools
 import logging
 import websockets
 from websockets.exceptions import ConnectionClosed
 from typing import List
 
+from . import jsoncodec
 from .question import Question
+from .websocketserver import get_client_address
+
+try:
+    from websockets import broadcast as websockets_broadcast
+except ImportError:
+    # websockets.broadcast() is only available from websockets 10.0
+    websockets_broadcast = None
 
 """
 Provides an abstraction for the single point of message exchange with a websocket client as a player.
 """
 
+# JSON RPC request envelope. Method names are fixed identifiers and do not need escaping.
+JSON_RPC_REQUEST_FORMAT = '{"id":%d,"method":"%s","params":%s}'
+
+# JSON RPC notification envelope. Notification is a request that does not expect a response,
+# and its id must be null.
+JSON_RPC_NOTIFICATION_FORMAT = '{"id":null,"method":"%s","params":%s}'
+
+# Maximum number of messages that can be queued for a player who is not reading them
+MAX_QUEUED_MESSAGES = 64
+
+# Maximum number of queued messages sent together in one websocket frame
+MAX_MESSAGES_PER_FRAME = 16
+
+# Announcements repeat: the fixed messages, the waiting message, and the round starting
+# messages which are the same for every game. Keep enough of them to cover long games.
+ANNOUNCEMENT_CACHE_SIZE = 128
+
+
+@functools.lru_cache(maxsize=ANNOUNCEMENT_CACHE_SIZE)
+def encode_announcement_params(message: str) -> str:
+    """Returns the JSON text of the announcement params. The JSON text is cached since the
+    same announcements are made over and over again.
+
+    Parameters
+    ----------
+    message: str
+        Message to announce
+    """
+    return jsoncodec.dumps({'message': message})
+
+
+def encode_round_result_params(question: Question, counts: List[int], message: str) -> str:
+    """Returns the JSON text of the round result params.
+
+    Parameters
+    ----------
+    question: Question
+        The original question
+    counts: List[int]
+        counts of each of the choices picked by all players
+    message: str
+        Message telling the player whether they have survived or been eliminated
+    """
+    return f'{{"question":{question.get_json()},"choice_counts":{jsoncodec.dumps(counts)},"message":{jsoncodec.dumps(message)}}}'
+
 
 class Player:
     """
@@ -22,16 +75,21 @@ class Player:
 
     Future object is used to signal that game is complete for the user.
 
+    Messages to the player are queued and written to the websocket by a writer task
+    dedicated to the player, so that sending to a slow player does not hold up the game.
+    Messages queued together are sent as a JSON array in one websocket frame.
+
     JSON RPC Example in 1 round of game:
 
     Server to the Client
     --------------------
     - If player connects but min number of players is not met yet
     {"id": 1, "method": "announcement", "params": {"message": "Please be patient. Waiting for 2 players to join."}}
-    - As soon as enough players are present, game round starts
-    {"id": 2, "method": "announcement", "params": {"message": "Game round 1 starting."}}
+    - As soon as enough players are present, game round starts. The same announcement goes
+      to every player in the game, so it is sent as a JSON RPC notification with null id.
+    {"id": null, "method": "announcement", "params": {"message": "Game round 1 starting."}}
     - Question is sent to the player
-    {"id": 3, "method": "ask_question", "params": {"question": "Pok&eacute;mon Go is a location-based augmented reality game developed and published by which company?", "choices": ["Rovio", "Zynga", "Supercell", "Niantic"]}}
+    {"id": 2, "method": "ask_question", "params": {"question": "Pok&eacute;mon Go is a location-based augmented reality game developed and published by which company?", "choices": ["Rovio", "Zynga", "Supercell", "Niantic"]}}
 
     Client to the Server
     --------------------
@@ -40,12 +98,15 @@ class Player:
 
     Server to the Client
     --------------------
-    - Answer and the stats are sent back to the player.
-    {"id": 4, "method": "answers", "params": {"question": {"question": "Pok&eacute;mon Go is a location-based augmented reality game developed and published by which company?", "choices": ["Rovio", "Zynga", "Supercell", "Niantic"], "answer": "Niantic"}, "choice_counts": [0, 1, 0, 0]}}
+    - Answer, the stats, and the result are sent back to the player in one message.
+      It is the same message for every player with the same result, so it is sent as a
+      JSON RPC notification with null id.
     - If the answer was wrong or was not provided within a timeout, this is sent:
-    {"id": 5, "method": "announcement", "params": {"message": "Did not receive a correct response! You have been eliminated from the game!"}}
+    {"id": null, "method": "round_result", "params": {"question": {"question": "Pok&eacute;mon Go is a location-based augmented reality game developed and published by which company?", "choices": ["Rovio", "Zynga", "Supercell", "Niantic"], "answer": "Niantic"}, "choice_counts": [0, 1, 0, 1], "message": "Did not receive a correct response! You have been eliminated from the game!"}}
     - Otherwise, answer was correct and this is sent:
-    {"id": 5, "method": "announcement", "params": {"message": "Congratulations, you are the winner!"}}
+    {"id": null, "method": "round_result", "params": {"question": {"question": "Pok&eacute;mon Go is a location-based augmented reality game developed and published by which company?", "choices": ["Rovio", "Zynga", "Supercell", "Niantic"], "answer": "Niantic"}, "choice_counts": [0, 1, 0, 1], "message": "You answered correctly!"}}
+    - If the player is the last one remaining, this is sent:
+    {"id": 3, "method": "announcement", "params": {"message": "Congratulations, you are the winner!"}}
 
     """
 
@@ -53,14 +114,26 @@ class Player:
         self.next_json_rcp_request_id = 1
         self.future = future
         self.websocket = websocket
+        # Remote address does not change for the connection, so read it once for the logging.
+        # Behind a trusted reverse proxy, this is the forwarded address of the client.
+        self.remote_address = get_client_address(websocket) if (
+            websocket != None) else None
+        # Created on the first send since the queue and the task need the running event loop
+        self.outbox = None
+        self.writer_task = None
+        # Messages queued but not yet written to the websocket
+        self.unsent_messages = 0
+        # Set when the player stops reading the messages and is disconnected
+        self.evicted = False
+        self.close_task = None
 
     def __repr__(self) -> str:
         return str(self)
 
     def __str__(self) -> str:
-        return f"Player: [remote={self.websocket.remote_address if not None else None}]"
+        return f"Player: [remote={self.remote_address}]"
 
-    async def send_question(self, question: Question):
+    async def send_question(self, question: Question) -> bool:
         """Send the question to the player in a JSON RCP request format
 
         Parameters
@@ -68,45 +141,107 @@ class Player:
         question: Question
             Question to send as JSON RPC request to this Player.
 
+        Returns
+        -------
+        Returns True if the question was queued. False if the player has been evicted.
         """
 
-        # Take out the answer first
-        params = question.__dict__.copy()
-        del params['answer']
+        return await self.send_encoded_json_rpc_request('ask_question', question.get_json_without_answer())
 
-        await self.send_json_rpc_request('ask_question', params)
+    async def send_announcement(self, message: str):
+        """Send an announcement message to the player in a JSON RCP request format
 
-    async def send_answers(self, question: Question, counts: List[int]):
-        """Send the answer and choice counts to the player in a JSON RCP request format
+        Parameters
+        ----------
+        message: str
+            Message to send as JSON RPC to this Player
+        """
+
+        await self.send_encoded_json_rpc_request('announcement', encode_announcement_params(message))
+
+    @staticmethod
+    async def broadcast_round_result(players: List['Player'], question: Question, counts: List[int], message: str):
+        """Send the same round result to all the players as a JSON RPC notification.
 
         Parameters
         ----------
+        players: List[Player]
+            Players to send to
         question: Question
             The original question
         counts: List[int]
             counts of each of the choices picked by all players
+        message: str
+            Message telling the players whether they have survived or been eliminated
         """
 
-        params = dict()
-        params['question'] = question.__dict__
-        params['choice_counts'] = counts
-
-        await self.send_json_rpc_request('answers', params)
+        await Player.broadcast_encoded_json_rpc_notification(players, 'round_result', encode_round_result_params(question, counts, message))
 
-    async def send_announcement(self, message: str):
-        """Send an announcement message to the player in a JSON RCP request format
+    @staticmethod
+    async def broadcast_announcement(players: List['Player'], message: str):
+        """Send the same announcement message to all the players as a JSON RPC notification.
 
         Parameters
         ----------
+        players: List[Player]
+            Players to send to
         message: str
-            Message to send as JSON RPC to this Player
+            Message to send as JSON RPC to the players
+        """
+
+        await Player.broadcast_encoded_json_rpc_notification(players, 'announcement', encode_announcement_params(message))
+
+    @staticmethod
+    async def broadcast_encoded_json_rpc_notification(players: List['Player'], method: str, params_json: str):
+        """Sends the same JSON RPC notification to all the players. Notification does not carry
+        the per player request id, so the message is serialized only once for all players.
+
+        websockets.broadcast() is used when it is available since it builds the websocket
+        frame once and writes it to every connection without awaiting each of them.
+        Connections that are not open are skipped. broadcast() does not wait for slow
+        connections and keeps adding to their write buffers, so it is only used for the
+        players who can_broadcast_directly(). The message is queued for the other players,
+        which keeps a player who stops reading subject to the queue limit and the eviction.
+        Without websockets.broadcast(), the message is queued for each player.
+
+        Parameters
+        ----------
+        players: List[Player]
+            Players to send to
+        method: str
+            Method to set on the JSON RPC 'method'.
+        params_json: str
+            JSON text to be put into the JSON RPC 'params' object.
+        """
+        json_string = JSON_RPC_NOTIFICATION_FORMAT % (method, params_json)
+
+        if (websockets_broadcast != None):
+            idle_websockets = []
+            for player in players:
+                if (player.can_broadcast_directly()):
+                    idle_websockets.append(player.websocket)
+                else:
+                    player.queue_json_string(json_string)
+
+            websockets_broadcast(idle_websockets, json_string)
+        else:
+            for player in players:
+                player.queue_json_string(json_string)
+
+    def can_broadcast_directly(self) -> bool:
+        """Returns True if a broadcast can be written straight to the websocket of this player.
+        Players who still have messages queued must get the broadcast through their queue as
+        well, otherwise it would overtake the messages sent before it. Players whose websocket
+        has not written out everything given to it are not keeping up, and the broadcast goes
+        through their queue so that they are evicted if they fall too far behind.
         """
+        if (self.unsent_messages != 0):
+            return False
 
-        # Take out the answer first
-        params = dict()
-        params['message'] = message
+        # transport is only set once the connection is made
+        transport = getattr(self.websocket, 'transport', None)
 
-        await self.send_json_rpc_request('announcement', params)
+        return (transport != None and transport.get_write_buffer_size() == 0)
 
     async def recv_answer(self):
         """Receive the result that contains just an answer
@@ -122,33 +257,145 @@ class Player:
 
         return result
 
-    async def send_json_rpc_request(self, method: str, params: dict):
-        """Returns JSON text from the method and params provided.
+    async def send_encoded_json_rpc_request(self, method: str, params_json: str) -> bool:
+        """Sends JSON RPC request whose params are already serialized into JSON text.
+        This allows the same serialized params to be shared among many players.
         Loosely following https: // www.jsonrpc.org / Version 1.0 for the request format.
 
         Parameters
         ----------
         method: str
-            Meethod to set on the JSON RPC 'method'.
-        params: dict
-            Params to be put into the JSON RPC 'params' object.
+            Method to set on the JSON RPC 'method'.
+        params_json: str
+            JSON text to be put into the JSON RPC 'params' object.
+
+        Returns
+        -------
+        Returns True if the request was queued. False if the player has been evicted.
         """
-        root = dict()
-        root['id'] = self.next_json_rcp_request_id
+        json_string = JSON_RPC_REQUEST_FORMAT % (
+            self.next_json_rcp_request_id, method, params_json)
         self.next_json_rcp_request_id += 1
 
-        root['method'] = method
-        root['params'] = params
-        json_string = json.dumps(root)
+        return await self.send_json_string(json_string)
+
+    async def send_json_string(self, json_string: str) -> bool:
+        """Sends the JSON text to the player as is. The message is queued and this returns
+        without waiting for the message to be written to the websocket.
+
+        Parameters
+        ----------
+        json_string: str
+            JSON text to send
+
+        Returns
+        -------
+        Returns True if the message was queued. False if the player has been evicted.
+        """
+        return self.queue_json_string(json_string)
+
+    def queue_json_string(self, json_string: str) -> bool:
+        """Queues the JSON text to be sent to the player by the writer task.
+        The writer task is started on the first message. If the player has too many
+        messages queued, the player is evicted instead.
+
+        Parameters
+        ----------
+        json_string: str
+            JSON text to send
+
+        Returns
+        -------
+        Returns True if the message was queued. False if the player has been evicted.
+        """
+        if (self.evicted):
+            return False
+
+        if (self.outbox == None):
+            self.outbox = asyncio.Queue(maxsize=MAX_QUEUED_MESSAGES)
+            self.writer_task = asyncio.create_task(
+                self.write_queued_messages())
 
         try:
-            await self.websocket.send(json_string)
-        except ConnectionClosed as e:
+            self.outbox.put_nowait(json_string)
+            self.unsent_messages += 1
+            return True
+        except asyncio.QueueFull:
             logging.warning(
-                "Connection closed while trying to send(): %s", e)
-        # TypeError can be raised but that would be a bug on our part in
-        # trying to send different types of data, and we want that to
-        # propagate to the user
+                "Too many messages queued. Evicting the player: [player=%s]", self)
+            self.evict()
+            return False
+
+    def evict(self):
+        """Disconnects the player who is not reading the messages. Skipping messages would leave
+        the player with a game they can no longer follow, so the connection is closed instead.
+        Receiving the answer then fails, and the game eliminates the player.
+        """
+        self.evicted = True
+
+        # Queued messages are never sent, so the writer is stopped right away
+        self.stop_sending()
+
+        self.close_task = asyncio.create_task(self.websocket.close())
+
+    async def write_queued_messages(self):
+        """Writes the queued messages to the websocket in order until cancelled.
+        Messages that are queued while the previous frame is being written are sent together
+        as a JSON array in a single frame.
+        """
+        # Look up the queue and the send method once for the lifetime of the writer
+        outbox = self.outbox
+        send = self.websocket.send
+
+        while True:
+            json_strings = [await outbox.get()]
+
+            while (not outbox.empty() and len(json_strings) < MAX_MESSAGES_PER_FRAME):
+                json_strings.append(outbox.get_nowait())
+
+            if (len(json_strings) == 1):
+                json_string = json_strings[0]
+            else:
+                json_string = '[' + ','.join(json_strings) + ']'
+
+            try:
+                await send(json_string)
+            except ConnectionClosed as e:
+                # The game finds out through recv() that the player is gone.
+                logging.warning(
+                    "Connection closed while trying to send(): %s", e)
+            except Exception:
+                # TypeError can be raised but that would be a bug on our part in trying
+                # to send different types of data. Log it since nobody awaits this task.
+                logging.exception(
+                    "Failed to send the message: [player=%s]", self)
+            finally:
+                self.unsent_messages -= len(json_strings)
+
+                for _ in json_strings:
+                    outbox.task_done()
+
+    async def finish_sending(self):
+        """Waits until all the queued messages are written to the websocket and stops the
+        writer task. Call this before letting the websocket close.
+        """
+        if (self.writer_task == None):
+            return
+
+        await self.outbox.join()
+
+        self.stop_sending()
+
+    def stop_sending(self):
+        """Stops the writer task without waiting for the queued messages to be written.
+        Messages still in the queue are discarded.
+        """
+        if (self.writer_task == None):
+            return
+
+        self.writer_task.cancel()
+        self.writer_task = None
+        self.outbox = None
 
     async def receive_json_rpc_response(self) -> (int, str, str):
         """Returns id, result, and error from JSON RPC response.
@@ -158,20 +405,18 @@ class Player:
         -------
         (id, error, result) if JSON successfully parsed. Otherwise(None, None, None).
         """
-        json_string = (None, None, None)
-
         try:
             json_string = await self.websocket.recv()
         except ConnectionClosed as e:
             logging.warning(
                 "Connection closed while waiting for recv(): %s", e)
-            # Set json string to None. It should cause exception below and return (None, None, None).
-            json_string = None
+            return (None, None, None)
         # RuntimeError can be raised if two coroutines call recv() concurrently.
         # That would be a bug and we want that to propagate to the user.
 
         try:
-            response = json.loads(json_string)
+            response = jsoncodec.loads(json_string)
             return (response['id'], response['error'], response['result'])
-        except:
+        except (ValueError, KeyError, TypeError):
+            # ValueError if not a valid JSON. KeyError or TypeError if not a JSON RPC response.
             return (None, None, None)
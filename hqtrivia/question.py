@@ -1,10 +1,12 @@
 from aiohttp import ClientSession
 import asyncio
-import json
+from collections import deque
 import random
 from typing import List
+from yarl import URL
 
 import hqtrivia.config as config
+from . import jsoncodec
 
 """
 Abstracts the multiple question to be used in the trivia game.
@@ -16,39 +18,166 @@ class Question:
     Represents 1 multiple question that will be used in a game round.
     """
 
+    # Questions are created every round, so avoid the per instance __dict__
+    __slots__ = ('question', 'choices', 'answer',
+                 '_json', '_json_without_answer')
+
     def __init__(self, question: str, choices: List[str], answer: str):
         self.question = question
         self.choices = choices
         self.answer = answer
+        # Same question is sent to every player in the game, so the JSON texts are
+        # serialized only once and cached.
+        self._json = None
+        self._json_without_answer = None
 
     def __repr__(self) -> str:
         return str(self)
 
     def __str__(self) -> str:
-        return str(self.__dict__)
+        return str(self.to_dict())
+
+    def to_dict(self) -> dict:
+        """Returns the question, choices, and answer as a dict.
+        """
+        return {'question': self.question, 'choices': self.choices, 'answer': self.answer}
+
+    def get_json(self) -> str:
+        """Returns the JSON text of this question including the answer.
+        """
+        if (self._json == None):
+            self._json = jsoncodec.dumps(self.to_dict())
+
+        return self._json
+
+    def get_json_without_answer(self) -> str:
+        """Returns the JSON text of this question without the answer so that it can be sent
+        to the players before the answer is revealed.
+        """
+        if (self._json_without_answer == None):
+            self._json_without_answer = jsoncodec.dumps(
+                {'question': self.question, 'choices': self.choices})
+
+        return self._json_without_answer
 
     @staticmethod
-    async def generate() -> 'Question':
+    async def generate(session: ClientSession = None) -> 'Question':
         """Generates a new question by calling a RESTful API on an open trivia internet server.
 
+        Parameters
+        ----------
+        session: ClientSession
+            HTTP client session to send the request with. Sharing a session lets the connections
+            to the trivia server be reused across the questions. If None, a new session is
+            created just for this question.
+
         Returns
         -------
         Returns the new question if successful.  If error was encountered or response is not 200 OK,
         an exception will be thrown.
         """
-        async with ClientSession() as session:
-            async with session.get(config.CONFIG_QUESTION_GENERATOR_API) as resp:
-                if (resp.status != 200):
-                    raise Exception(
-                        f"Received response {resp.status} from {config.CONFIG_QUESTION_GENERATOR_API}")
+        # Only one question is needed, so do not let the server generate the configured amount
+        return (await Question.generate_many(session, 1))[0]
 
-                # Convert JSON to our Question and return it
-                text = await resp.text()
-                return opentdb_json_to_question(text)
+    @staticmethod
+    async def generate_many(session: ClientSession = None, amount: int = None) -> List['Question']:
+        """Generates as many questions as the open trivia internet server returns for one request.
 
+        Parameters
+        ----------
+        session: ClientSession
+            HTTP client session to send the request with. If None, a new session is created just
+            for this request.
+        amount: int
+            Number of questions to request. If None, the 'amount' in the configured API is used.
 
-def opentdb_json_to_question(json_text: str) -> Question:
-    """A quick "hack" for converting opentdb json result to our Question instance.
+        Returns
+        -------
+        Returns the new questions if successful.  If error was encountered, response is not 200 OK,
+        or no question was returned, an exception will be thrown.
+        """
+        if (session == None):
+            async with ClientSession() as session:
+                return await Question.generate_many(session, amount)
+
+        api = config.CONFIG_QUESTION_GENERATOR_API
+
+        if (amount != None):
+            api = str(URL(api).update_query(amount=amount))
+
+        async with session.get(api) as resp:
+            if (resp.status != 200):
+                raise Exception(
+                    f"Received response {resp.status} from {api}")
+
+            # Convert JSON to our Questions and return them.
+            # JSON decoder takes the raw bytes so there is no need to decode them first.
+            data = await resp.read()
+            questions = opentdb_json_to_questions(data)
+
+        if (len(questions) == 0):
+            raise Exception(f"Received no questions from {api}")
+
+        return questions
+
+
+class QuestionPool:
+    """
+    Pool of questions shared by all the games.
+
+    The trivia server returns several questions for one request, so the questions that are
+    not used right away are kept for the following rounds instead of requesting a new
+    question every round. Games that run out of questions at the same time share one request.
+    """
+
+    def __init__(self, session: ClientSession = None):
+        """
+        Parameters
+        ----------
+        session: ClientSession
+            HTTP client session to generate the questions with
+        """
+        self.session = session
+        self.questions = deque()
+        self.fetch_task = None
+
+    async def get(self) -> Question:
+        """Returns the next question from the pool. Questions are generated if the pool is empty.
+
+        Returns
+        -------
+        Returns the question.  If the questions could not be generated, an exception will be thrown.
+        """
+        while (len(self.questions) == 0):
+            if (self.fetch_task == None):
+                self.fetch_task = asyncio.create_task(self.fetch())
+
+            # Shield the request shared with the other games from being cancelled by this caller
+            await asyncio.shield(self.fetch_task)
+
+        return self.questions.popleft()
+
+    def put_back(self, question: Question):
+        """Returns an unused question to the front of the pool so that it is the next one handed out.
+
+        Parameters
+        ----------
+        question: Question
+            Question taken from the pool with get() but never used
+        """
+        self.questions.appendleft(question)
+
+    async def fetch(self):
+        """Generates the questions and adds them to the pool.
+        """
+        try:
+            self.questions.extend(await Question.generate_many(self.session))
+        finally:
+            self.fetch_task = None
+
+
+def opentdb_json_to_questions(json_text) -> List[Question]:
+    """Converts all the results in opentdb json(str or bytes) to our Question instances.
 
     Example JSON from opentdb.com:
 
@@ -64,15 +193,17 @@ def opentdb_json_to_question(json_text: str) -> Question:
         }]
     }
     """
+    return [opentdb_result_to_question(result) for result in jsoncodec.loads(json_text)['results']]
 
-    result = json.loads(json_text)['results'][0]
-    incorrect_choices = result['incorrect_answers']
-    answer = result['correct_answer']
 
-    # Insert correct answer randomly into the middle of incorrect answers
-    random_index = random.randint(0, len(incorrect_choices))
+def opentdb_result_to_question(result: dict) -> Question:
+    """Converts one of the results in opentdb json to our Question instance.
+    """
+    answer = result['correct_answer']
 
-    choices = incorrect_choices.copy()
-    choices.insert(random_index, answer)
+    # Insert correct answer randomly into the middle of incorrect answers. The list comes
+    # from the freshly parsed JSON and is not used elsewhere, so it is reused without a copy.
+    choices = result['incorrect_answers']
+    choices.insert(random.randint(0, len(choices)), answer)
 
     return Question(result['question'], choices, answer)
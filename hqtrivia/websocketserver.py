@@ -2,10 +2,47 @@ import asyncio
 import logging
 import websockets
 
+import hqtrivia.config as config
+
 """
 Abstracts the websocketserver logic
 """
 
+# Trivia messages are short JSON texts, so compressing them costs more CPU than it saves
+# bandwidth. Broadcasts would also compress the same message again for every connection.
+WS_COMPRESSION = None
+
+# Clients only send back short answers. Anything larger is not a valid message.
+WS_MAX_MESSAGE_SIZE = 2 ** 13
+
+# Messages in either direction are small, so the default 64 KiB read and write buffers of
+# each connection are mostly unused memory.
+WS_READ_LIMIT = 2 ** 13
+WS_WRITE_LIMIT = 2 ** 13
+
+
+def get_client_address(websocket: websockets.WebSocketServerProtocol):
+    """Returns the address of the client on the other end of the websocket.
+
+    TLS is meant to be terminated by a reverse proxy in front of this server, in which case
+    remote_address is the proxy. If the proxy is trusted, the client address is taken from
+    the X-Forwarded-For header instead.
+
+    Parameters
+    ----------
+    websocket: WebSocketServerProtocol
+        The websocket for the connection
+    """
+    if (config.CONFIG_TRUST_PROXY_HEADERS):
+        forwarded_for = websocket.request_headers.get('X-Forwarded-For')
+
+        if (forwarded_for != None):
+            # The trusted proxy appends the address it received the request from. The
+            # addresses before it are sent by the client and cannot be trusted.
+            return forwarded_for.split(',')[-1].strip()
+
+    return websocket.remote_address
+
 
 class WebsocketCallbackInterface:
     """
@@ -60,9 +97,11 @@ class WebsocketServer:
         path: str
             The wss request URI that created the websocket connection
         """
+        client_address = get_client_address(websocket)
+
         try:
             logging.info(
-                f"New websocket connection: [to={path} from={websocket.remote_address}]")
+                "New websocket connection: [to=%s from=%s]", path, client_address)
             await self.callback.handle_new_websocket(websocket)
 
         except Exception as e:
@@ -70,7 +109,7 @@ class WebsocketServer:
 
         finally:
             logging.info(
-                f"Closing websocket connection: [to={path} from={websocket.remote_address}]")
+                "Closing websocket connection: [to=%s from=%s]", path, client_address)
 
         # websocket library will ensure that the websockets gets closed,
         # and I do not have to close it here.
@@ -79,4 +118,6 @@ class WebsocketServer:
         # This is actually returning a coroutine that can be run via asyncio
         # Do not specify the host so that I'm not bound to a specific NIC
         return websockets.serve(
-            self.ws_handler_impl, port=self.port)
+            self.ws_handler_impl, port=self.port,
+            compression=WS_COMPRESSION, max_size=WS_MAX_MESSAGE_SIZE,
+            read_limit=WS_READ_LIMIT, write_limit=WS_WRITE_LIMIT)
@@ -0,0 +1,8 @@
+import asyncio
+
+# Run the tests on the same event loop as the server does when uvloop is installed
+try:
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:
+    pass
@@ -1,6 +1,8 @@
 import aiohttp
 import asyncio
 import logging
+import os
+import tempfile
 import unittest
 from unittest.mock import AsyncMock
 from unittest.mock import patch
@@ -17,6 +19,7 @@ class ConfigTest(unittest.TestCase):
         self.CONFIG_WS_SERVER_PORT = config.CONFIG_WS_SERVER_PORT
         self.CONFIG_ROUND_DURATION = config.CONFIG_ROUND_DURATION
         self.CONFIG_QUESTION_GENERATOR_API = config.CONFIG_QUESTION_GENERATOR_API
+        self.CONFIG_TRUST_PROXY_HEADERS = config.CONFIG_TRUST_PROXY_HEADERS
 
     def tearDown(self):
         # Restore them
@@ -25,6 +28,7 @@ class ConfigTest(unittest.TestCase):
         config.CONFIG_WS_SERVER_PORT = self.CONFIG_WS_SERVER_PORT
         config.CONFIG_ROUND_DURATION = self.CONFIG_ROUND_DURATION
         config.CONFIG_QUESTION_GENERATOR_API = self.CONFIG_QUESTION_GENERATOR_API
+        config.CONFIG_TRUST_PROXY_HEADERS = self.CONFIG_TRUST_PROXY_HEADERS
 
     def test_load_config(self):
         """Tests load_config method
@@ -37,3 +41,18 @@ class ConfigTest(unittest.TestCase):
         self.assertEqual(config.CONFIG_ROUND_DURATION, 60)
         self.assertEqual(config.CONFIG_QUESTION_GENERATOR_API,
                          'http://httpbin.org/status/400')
+        self.assertEqual(config.CONFIG_TRUST_PROXY_HEADERS, True)
+
+    def test_load_config_ignores_unknown_keys(self):
+        """Tests that load_config() ignores the keys it does not know about
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            config_file = os.path.join(temp_dir, 'config.json')
+
+            with open(config_file, 'w') as f:
+                f.write('{"players_per_game": 3, "unknown_key": 1}')
+
+            config.load_config(config_file)
+
+        self.assertEqual(config.CONFIG_PLAYERS_PER_GAME, 3)
+        self.assertFalse(hasattr(config, 'unknown_key'))
@@ -13,27 +13,36 @@ from hqtrivia.player import Player
 
 class GameManagerTest(unittest.TestCase):
 
-    @patch('asyncio.get_event_loop', new_callable=MagicMock)
-    def test_main(self, my_event_loop):
-        """Tests whether main() starts up the websockets server through asyncio api
+    @patch('asyncio.run', new_callable=MagicMock)
+    def test_main(self, run):
+        """Tests whether main() runs main_async() through asyncio api
         """
 
-        run_until_complete = MagicMock()
-        run_forever = MagicMock()
+        gm = GameManager()
+        gm.main_async = MagicMock()
+
+        gm.main()
 
-        my_event_loop.attach_mock(run_until_complete, 'run_until_complete')
-        my_event_loop.attach_mock(run_forever, 'run_forever')
+        gm.main_async.assert_called_once()
+        run.assert_called_once_with(gm.main_async.return_value)
+
+    def test_main_async(self):
+        """Tests whether main_async() starts up the websockets server and keeps waiting
+        """
 
         gm = GameManager()
-        gm.wsserver.start = MagicMock()
+        gm.wsserver.start = AsyncMock()
 
-        gm.main()
+        async def my_coroutine():
+            # Indirectly I can be confident that it is waiting forever.
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(gm.main_async(), timeout=0.1)
+
+        asyncio.run(my_coroutine())
 
-        run_until_complete.called_once_with(gm.wsserver.start)
-        # Getting called but mock is not recording it. Comment out for now until
-        # it's figured out later.
-        # run_forever.assert_called_once()
         gm.wsserver.start.assert_called_once()
+        self.assertIsNone(gm.http_session,
+                          "HTTP session must be closed when the server stops")
 
     def test_handle_new_websocket(self):
         """Tests whether handle_new_websocket() calls wait_until_game_complete().
@@ -41,7 +50,7 @@ class GameManagerTest(unittest.TestCase):
 
         gm = GameManager()
         gm.wait_until_game_complete = AsyncMock()
-        ws = websockets.WebSocketServerProtocol(None, None)
+        ws = MagicMock(spec=websockets.WebSocketServerProtocol)
 
         asyncio.run(gm.handle_new_websocket(ws))
 
@@ -62,7 +71,7 @@ class GameManagerTest(unittest.TestCase):
 
             # Indirectly I can be confident that it timed out waiting for future.
             with self.assertRaises(asyncio.TimeoutError):
-                await asyncio.wait_for(gm.wait_until_game_complete(player), timeout=1)
+                await asyncio.wait_for(gm.wait_until_game_complete(player), timeout=0.05)
 
             self.assertEqual(len(gm.waiting_players), 1,
                              "Number of waiting players must be 1")
@@ -86,6 +95,28 @@ class GameManagerTest(unittest.TestCase):
 
         asyncio.run(my_coroutine())
 
+    def test_wait_until_game_complete_cancelled(self):
+        """Tests whether wait_until_game_complete() stops the writer of the player when it is cancelled
+        """
+
+        async def my_coroutine():
+            gm = GameManager()
+            websocket = MagicMock(spec=websockets.WebSocketServerProtocol)
+            websocket.send = AsyncMock()
+            player = Player(asyncio.get_running_loop().create_future(), websocket)
+
+            # Future is never set, so the wait is cancelled by the timeout
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(gm.wait_until_game_complete(player), timeout=0.05)
+
+            return player
+
+        player = asyncio.run(my_coroutine())
+
+        # Waiting announcement was sent, and the writer is not left pending
+        player.websocket.send.assert_called_once()
+        self.assertIsNone(player.writer_task)
+
     @patch('hqtrivia.gamesession.GameSession.run', new_callable=AsyncMock)
     def test_wait_until_game_complete_enough_players(self, run):
         """Tests whether wait_until_game_complete() runs a game if there are enough players
@@ -100,11 +131,19 @@ class GameManagerTest(unittest.TestCase):
                 future.set_result(None)
                 player.send_announcement = AsyncMock()
 
-                await asyncio.wait_for(gm.wait_until_game_complete(player), timeout=1)
+                await gm.wait_until_game_complete(player)
 
             self.assertEqual(len(gm.waiting_players), 0,
                              "Number of waiting players must be 0")
 
             run.assert_called_once()
 
-        asyncio.run(my_coroutine())
+            # Let the game task finish
+            await asyncio.gather(*gm.game_tasks)
+            await asyncio.sleep(0)
+
+            self.assertEqual(len(gm.game_tasks), 0,
+                             "Game task must be removed when done")
+
+        # Single timeout for the whole test in case it hangs, rather than one per player
+        asyncio.run(asyncio.wait_for(my_coroutine(), timeout=5))
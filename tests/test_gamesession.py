@@ -12,13 +12,44 @@ from hqtrivia.messages import *
 from hqtrivia.question import Question
 from hqtrivia.player import Player
 
+# Question used by the rounds in the tests. GameSession never modifies the question.
+QUESTION = Question('Question 1', ['A', 'B', 'C', 'D'], 'C')
+
+
+class CopyingAsyncMock(AsyncMock):
+    """AsyncMock that records copies of the list arguments since GameSession keeps
+    modifying the players list after passing it.
+    """
+
+    def __call__(self, *args, **kwargs):
+        args = [arg.copy() if isinstance(arg, list) else arg for arg in args]
+        return super().__call__(*args, **kwargs)
+
 
 class GameSessionTest(unittest.TestCase):
 
     def setUp(self):
-        # Set to a shorter time for faster test
+        # Set to a shorter time for faster test. Players who time out are cancelled at the
+        # end of the round, so this is how long the timeout tests take.
         self.original_round_duration = config.CONFIG_ROUND_DURATION
-        config.CONFIG_ROUND_DURATION = min(2, config.CONFIG_ROUND_DURATION)
+        config.CONFIG_ROUND_DURATION = 0.05
+
+        # Every round gets the same question unless the test says otherwise
+        generate_patcher = patch(
+            'hqtrivia.question.Question.generate', new_callable=AsyncMock, return_value=QUESTION)
+        self.generate = generate_patcher.start()
+        self.addCleanup(generate_patcher.stop)
+
+        # Broadcasts bypass the per player methods, so mock them separately
+        broadcast_round_result_patcher = patch(
+            'hqtrivia.player.Player.broadcast_round_result', new_callable=CopyingAsyncMock)
+        self.broadcast_round_result = broadcast_round_result_patcher.start()
+        self.addCleanup(broadcast_round_result_patcher.stop)
+
+        broadcast_announcement_patcher = patch(
+            'hqtrivia.player.Player.broadcast_announcement', new_callable=CopyingAsyncMock)
+        self.broadcast_announcement = broadcast_announcement_patcher.start()
+        self.addCleanup(broadcast_announcement_patcher.stop)
 
     def tearDown(self):
         config.CONFIG_ROUND_DURATION = self.original_round_duration
@@ -26,17 +57,16 @@ class GameSessionTest(unittest.TestCase):
     def get_mocked_player(self, answer):
         """Helper method to get a mocked up player for use
         """
-        player = MagicMock()
-        send_announcement = AsyncMock()
-        player.attach_mock(send_announcement, 'send_announcement')
-        send_question = AsyncMock()
-        player.attach_mock(send_question, 'send_question')
-        send_answers = AsyncMock()
-        player.attach_mock(send_answers, 'send_answers')
-        recv_answer = AsyncMock()
-        player.attach_mock(recv_answer, 'recv_answer')
-        recv_answer.return_value = answer
-        return (player, send_announcement, send_question, send_answers, recv_answer)
+        player = MagicMock(spec=Player)
+        # future is set in Player.__init__(), so the spec does not know about it
+        player.future = MagicMock(spec=asyncio.Future)
+        player.future.done.return_value = False
+        # Tests only check the calls on each method, never player.mock_calls, so the
+        # methods are simply assigned
+        player.send_announcement = send_announcement = AsyncMock()
+        player.send_question = send_question = AsyncMock(return_value=True)
+        player.recv_answer = recv_answer = AsyncMock(return_value=answer)
+        return (player, send_announcement, send_question, recv_answer)
 
     def test_run(self):
         """Tests that run() method calls execute_next_round() only once if it returns False.
@@ -71,9 +101,7 @@ class GameSessionTest(unittest.TestCase):
     def test_abort_game(self):
         """Tests that abort_game() method calls handle_eliminated_players() once
         """
-        player = MagicMock()
-        send_announcement = AsyncMock()
-        player.attach_mock(send_announcement, 'send_announcement')
+        player = MagicMock(spec=Player)
 
         game = GameSession(0, [player])
         game.handle_eliminated_players = MagicMock()
@@ -81,22 +109,33 @@ class GameSessionTest(unittest.TestCase):
         asyncio.run(game.abort_game())
 
         game.handle_eliminated_players.assert_called_once()
-        send_announcement.assert_called_once_with(
-            MESSAGE_NETWORK_ERROR_OCCURRED)
+        self.broadcast_announcement.assert_called_once_with(
+            [player], MESSAGE_NETWORK_ERROR_OCCURRED)
+
+    def test_handle_eliminated_players_skips_released_players(self):
+        """Tests that handle_eliminated_players() does not set the future that is already done
+        """
+        (player1, _, _, _) = self.get_mocked_player('A')
+        (player2, _, _, _) = self.get_mocked_player('B')
+        player2.future.done.return_value = True
+
+        game = GameSession(0, [player1, player2])
+        game.handle_eliminated_players([player1, player2])
+
+        player1.future.set_result.assert_called_once_with(None)
+        player2.future.set_result.assert_not_called()
 
-    @patch('hqtrivia.question.Question.generate', new_callable=AsyncMock)
-    def test_execute_next_round_identifies_winner(self, generate):
+    def test_execute_next_round_identifies_winner(self):
         """Tests that execute_next_round() method correctly identifies winner from the game.
         """
-        question = Question('Question 1', ['A', 'B', 'C', 'D'], 'C')
-        generate.return_value = question
+        question = QUESTION
 
         # Create player 1 with wrong answer, and player 2 with the right answer
         (player1, send_announcement1, send_question1,
-         send_answers1, recv_answer1) = self.get_mocked_player('D')
+         recv_answer1) = self.get_mocked_player('D')
 
         (player2, send_announcement2, send_question2,
-         send_answers2, recv_answer2) = self.get_mocked_player('C')
+         recv_answer2) = self.get_mocked_player('C')
 
         game = GameSession(0, [player1, player2])
 
@@ -108,36 +147,39 @@ class GameSessionTest(unittest.TestCase):
         self.assertEqual(len(game.players), 0,
                          "No player should remain in the game")
 
+        # Check that the start of the round was announced to all players at once
+        self.broadcast_announcement.assert_called_once_with(
+            [player1, player2], 'Game round 1 starting.')
+
         # Check that the question was sent to the players
         send_question1.assert_any_call(question)
         send_question2.assert_any_call(question)
 
-        # Check that the count of the answers from each participant was sent
-        send_answers1.assert_any_call(question, [0, 0, 1, 1])
-        send_answers2.assert_any_call(question, [0, 0, 1, 1])
+        # Check that the count of the answers and the result were sent to each participant
+        self.broadcast_round_result.assert_has_calls([
+            call([player2], question, [0, 0, 1, 1], MESSAGE_CORRECT_ANSWER),
+            call([player1], question, [0, 0, 1, 1], MESSAGE_YOU_ARE_ELIMINATED)], any_order=True)
 
-        # Check that these message were sent last
-        send_announcement1.assert_called_with(MESSAGE_YOU_ARE_ELIMINATED)
+        # Check that the winner was announced last
         send_announcement2.assert_called_with(MESSAGE_YOU_ARE_THE_WINNER)
 
-    @patch('hqtrivia.question.Question.generate', new_callable=AsyncMock)
-    def test_execute_next_round_player_times_out(self, generate):
+    def test_execute_next_round_player_times_out(self):
         """Tests that execute_next_round() eliminates player who did not respond within timeout.
         """
-        question = Question('Question 1', ['A', 'B', 'C', 'D'], 'C')
-        generate.return_value = question
+        question = QUESTION
 
         # Create player 1 with the wrong answer, and player 2 will timeout
         (player1, send_announcement1, send_question1,
-         send_answers1, recv_answer1) = self.get_mocked_player('D')
+         recv_answer1) = self.get_mocked_player('D')
 
         async def over_sleep():
-            await asyncio.sleep(config.CONFIG_ROUND_DURATION+1)
+            # Never completes, so the round always times out waiting for player 2
+            await asyncio.get_running_loop().create_future()
 
         (player2, send_announcement2, send_question2,
-         send_answers2, recv_answer2) = self.get_mocked_player(None)
+         recv_answer2) = self.get_mocked_player(None)
 
-        player2.attach_mock(over_sleep, 'recv_answer')
+        player2.recv_answer = over_sleep
 
         game = GameSession(0, [player1, player2])
 
@@ -149,36 +191,30 @@ class GameSessionTest(unittest.TestCase):
         self.assertEqual(len(game.players), 0,
                          "No player should remain in the game")
 
-        # Check that the question was sent to the players
         # Check that the question was sent to the players
         send_question1.assert_any_call(question)
         send_question2.assert_any_call(question)
 
-        # Check that the count of the answers from each participant was sent
-        send_answers1.assert_any_call(question, [0, 0, 0, 1])
-        send_answers2.assert_any_call(question, [0, 0, 0, 1])
-
-        # Check that these message were sent last
-        send_announcement1.assert_called_with(MESSAGE_YOU_ARE_ELIMINATED)
-        send_announcement1.assert_called_with(MESSAGE_YOU_ARE_ELIMINATED)
+        # Check that the count of the answers and the result were sent to each participant
+        self.broadcast_round_result.assert_has_calls([
+            call([], question, [0, 0, 0, 1], MESSAGE_CORRECT_ANSWER),
+            call([player1, player2], question, [0, 0, 0, 1], MESSAGE_YOU_ARE_ELIMINATED)], any_order=True)
 
-    @patch('hqtrivia.question.Question.generate', new_callable=AsyncMock)
-    def test_execute_next_round_player_recvMessage_exception(self, generate):
+    def test_execute_next_round_player_recvMessage_exception(self):
         """Tests that execute_next_round() eliminates player who did not respond within timeout.
         """
-        question = Question('Question 1', ['A', 'B', 'C', 'D'], 'C')
-        generate.return_value = question
+        question = QUESTION
 
         # Create player 1 with wrong answer, and player 2 with the right answer
         (player1, send_announcement1, send_question1,
-         send_answers1, recv_answer1) = self.get_mocked_player('D')
+         recv_answer1) = self.get_mocked_player('D')
 
         (player2, send_announcement2, send_question2,
-         send_answers2, recv_answer2) = self.get_mocked_player('C')
+         recv_answer2) = self.get_mocked_player('C')
 
         recv_answer2 = AsyncMock(side_effect=Exception(
             'General Error during recv_answer()'))
-        player2.attach_mock(recv_answer2, 'recv_answer')
+        player2.recv_answer = recv_answer2
 
         game = GameSession(0, [player1, player2])
 
@@ -194,27 +230,53 @@ class GameSessionTest(unittest.TestCase):
         send_question1.assert_any_call(question)
         send_question2.assert_any_call(question)
 
-        # Check that the count of the answers from each participant was sent
-        send_answers1.assert_any_call(question, [0, 0, 0, 1])
-        send_answers2.assert_any_call(question, [0, 0, 0, 1])
+        # Check that the count of the answers and the result were sent to each participant
+        self.broadcast_round_result.assert_has_calls([
+            call([], question, [0, 0, 0, 1], MESSAGE_CORRECT_ANSWER),
+            call([player1, player2], question, [0, 0, 0, 1], MESSAGE_YOU_ARE_ELIMINATED)], any_order=True)
+
+    def test_execute_next_round_player_evicted(self):
+        """Tests that execute_next_round() eliminates player who was evicted before the question could be sent.
+        """
+        question = QUESTION
+
+        # Both players have the right answer, but player 2 has been evicted and is not sent the question
+        (player1, send_announcement1, send_question1,
+         recv_answer1) = self.get_mocked_player('C')
+
+        (player2, send_announcement2, send_question2,
+         recv_answer2) = self.get_mocked_player('C')
+
+        send_question2.return_value = False
+
+        game = GameSession(0, [player1, player2])
+
+        result = asyncio.run(game.execute_next_round())
+
+        self.assertFalse(
+            result, "execute_next_round() should return False since game ended with a winner.")
 
-        # Check that these message were sent last
-        send_announcement1.assert_called_with(MESSAGE_YOU_ARE_ELIMINATED)
-        send_announcement1.assert_called_with(MESSAGE_YOU_ARE_ELIMINATED)
+        recv_answer2.assert_not_called()
 
-    @patch('hqtrivia.question.Question.generate', new_callable=AsyncMock)
-    def test_execute_next_round_move_to_next_round(self, generate):
+        # Check that the count of the answers and the result were sent to each participant
+        self.broadcast_round_result.assert_has_calls([
+            call([player1], question, [0, 0, 1, 0], MESSAGE_CORRECT_ANSWER),
+            call([player2], question, [0, 0, 1, 0], MESSAGE_YOU_ARE_ELIMINATED)], any_order=True)
+
+        # Check that the winner was announced last
+        send_announcement1.assert_called_with(MESSAGE_YOU_ARE_THE_WINNER)
+
+    def test_execute_next_round_move_to_next_round(self):
         """Tests that execute_next_round() method has to continue to the next round.
         """
-        question = Question('Question 1', ['A', 'B', 'C', 'D'], 'C')
-        generate.return_value = question
+        question = QUESTION
 
         # Both players gives the correct answer
         (player1, send_announcement1, send_question1,
-         send_answers1, recv_answer1) = self.get_mocked_player('C')
+         recv_answer1) = self.get_mocked_player('C')
 
         (player2, send_announcement2, send_question2,
-         send_answers2, recv_answer2) = self.get_mocked_player('C')
+         recv_answer2) = self.get_mocked_player('C')
 
         game = GameSession(0, [player1, player2])
 
@@ -230,27 +292,62 @@ class GameSessionTest(unittest.TestCase):
         send_question1.assert_any_call(question)
         send_question2.assert_any_call(question)
 
-        # Check that the count of the answers from each participant was sent
-        send_answers1.assert_any_call(question, [0, 0, 2, 0])
-        send_answers2.assert_any_call(question, [0, 0, 2, 0])
+        # Check that the count of the answers and the result were sent to each participant
+        self.broadcast_round_result.assert_has_calls([
+            call([player1, player2], question, [0, 0, 2, 0], MESSAGE_CORRECT_ANSWER),
+            call([], question, [0, 0, 2, 0], MESSAGE_YOU_ARE_ELIMINATED)], any_order=True)
+
+    def test_execute_next_round_prefetches_next_question(self):
+        """Tests that execute_next_round() uses the question prefetched in the previous round.
+        """
+        question1 = Question('Question 1', ['A', 'B', 'C', 'D'], 'C')
+        question2 = Question('Question 2', ['A', 'B', 'C', 'D'], 'A')
+
+        question_pool = MagicMock()
+        get = AsyncMock(side_effect=[question1, question2, question1])
+        question_pool.get = get
+
+        # Both players gives the correct answer in the first round
+        (player1, send_announcement1, send_question1,
+         recv_answer1) = self.get_mocked_player('C')
+
+        (player2, send_announcement2, send_question2,
+         recv_answer2) = self.get_mocked_player('C')
+
+        game = GameSession(0, [player1, player2], question_pool)
+
+        async def my_coroutine():
+            await game.execute_next_round()
+            await game.execute_next_round()
+
+            self.assertIsNotNone(game.next_question_task,
+                                 "Question for the next round must be prefetched")
+
+            game.cancel_next_question()
+
+            self.assertIsNone(game.next_question_task)
+
+        asyncio.run(my_coroutine())
+
+        # Question for this round and the next round is taken from the pool in each round
+        self.assertEqual(get.call_count, 3)
+
+        send_question1.assert_has_calls([call(question1), call(question2)])
 
-        # Check that these message were sent last
-        send_announcement1.assert_called_with(MESSAGE_CORRECT_ANSWER)
-        send_announcement1.assert_called_with(MESSAGE_CORRECT_ANSWER)
+        # Question prefetched for the round that never happened goes back to the pool
+        question_pool.put_back.assert_called_once_with(question1)
 
-    @patch('hqtrivia.question.Question.generate', new_callable=AsyncMock)
-    def test_execute_next_round_all_eliminated(self, generate):
+    def test_execute_next_round_all_eliminated(self):
         """Tests that execute_next_round() method eliminates everyone without winner
         """
-        question = Question('Question 1', ['A', 'B', 'C', 'D'], 'C')
-        generate.return_value = question
+        question = QUESTION
 
         # Both players gives wrong answer
         (player1, send_announcement1, send_question1,
-         send_answers1, recv_answer1) = self.get_mocked_player('A')
+         recv_answer1) = self.get_mocked_player('A')
 
         (player2, send_announcement2, send_question2,
-         send_answers2, recv_answer2) = self.get_mocked_player('B')
+         recv_answer2) = self.get_mocked_player('B')
 
         game = GameSession(0, [player1, player2])
 
@@ -266,28 +363,27 @@ class GameSessionTest(unittest.TestCase):
         send_question1.assert_any_call(question)
         send_question2.assert_any_call(question)
 
-        # Check that the count of the answers from each participant was sent
-        send_answers1.assert_any_call(question, [1, 1, 0, 0])
-        send_answers2.assert_any_call(question, [1, 1, 0, 0])
+        # Check that the count of the answers and the result were sent to each participant
+        self.broadcast_round_result.assert_has_calls([
+            call([], question, [1, 1, 0, 0], MESSAGE_CORRECT_ANSWER),
+            call([player1, player2], question, [1, 1, 0, 0], MESSAGE_YOU_ARE_ELIMINATED)], any_order=True)
 
-        # Check that these message were sent last
-        send_announcement1.assert_called_with(MESSAGE_YOU_ARE_ELIMINATED)
-        send_announcement1.assert_called_with(MESSAGE_YOU_ARE_ELIMINATED)
+        # Check that the eliminated players were released
+        player1.future.set_result.assert_called_once_with(None)
+        player2.future.set_result.assert_called_once_with(None)
 
-    @patch('hqtrivia.question.Question.generate', new_callable=AsyncMock)
-    def test_run_exception_question_generator(self, generate):
+    def test_run_exception_question_generator(self):
         """Tests that run() method eliminates everyone without winner
         """
-        question = Question('Question 1', ['A', 'B', 'C', 'D'], 'C')
-        generate.return_value = question
-        generate.side_effect = Exception("Network Error!!!")
+        question = QUESTION
+        self.generate.side_effect = Exception("Network Error!!!")
 
         # Both players give wrong answer, but not important since Question.generate will throw exception
         (player1, send_announcement1, send_question1,
-         send_answers1, recv_answer1) = self.get_mocked_player('A')
+         recv_answer1) = self.get_mocked_player('A')
 
         (player2, send_announcement2, send_question2,
-         send_answers2, recv_answer2) = self.get_mocked_player('B')
+         recv_answer2) = self.get_mocked_player('B')
 
         game = GameSession(0, [player1, player2])
 
@@ -297,8 +393,8 @@ class GameSessionTest(unittest.TestCase):
         self.assertEqual(len(game.players), 0,
                          "No one should remain in the game")
 
-        # Check that these message were sent last
-        send_announcement1.assert_called_once_with(
-            MESSAGE_NETWORK_ERROR_OCCURRED)
-        send_announcement2.assert_called_once_with(
-            MESSAGE_NETWORK_ERROR_OCCURRED)
+        # Check that the error was announced to everyone
+        self.broadcast_announcement.assert_called_once_with(
+            [player1, player2], MESSAGE_NETWORK_ERROR_OCCURRED)
+        send_announcement1.assert_not_called()
+        send_announcement2.assert_not_called()
@@ -0,0 +1,27 @@
+import unittest
+
+from hqtrivia import jsoncodec
+
+
+class JsonCodecTest(unittest.TestCase):
+
+    def test_dumps(self):
+        """Tests that dumps() returns a compact JSON text
+        """
+        text = jsoncodec.dumps(
+            {'id': 1, 'params': {'choices': ['A', 'Pokémon']}})
+
+        self.assertEqual(
+            text, '{"id":1,"params":{"choices":["A","Pokémon"]}}')
+
+    def test_loads(self):
+        """Tests that loads() accepts both str and bytes
+        """
+        self.assertEqual(jsoncodec.loads('{"a":[1,2]}'), {'a': [1, 2]})
+        self.assertEqual(jsoncodec.loads(b'{"a":[1,2]}'), {'a': [1, 2]})
+
+    def test_loads_invalid_json(self):
+        """Tests that loads() raises ValueError for an invalid JSON text
+        """
+        with self.assertRaises(ValueError):
+            jsoncodec.loads('not a json')
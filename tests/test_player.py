@@ -4,56 +4,97 @@ from unittest.mock import AsyncMock
 from unittest.mock import MagicMock
 from unittest.mock import call
 from unittest.mock import patch
+import websockets
 from websockets.exceptions import ConnectionClosed
 
 from hqtrivia.gamesession import GameSession
 from hqtrivia.messages import *
 from hqtrivia.question import Question
 from hqtrivia.player import Player
+from hqtrivia.player import encode_announcement_params
 
 
 class PlayerTest(unittest.TestCase):
 
-    def test_player_send_json_rpc_request(self):
-        """Tests that Player.send_json_rpc_request() calls websocket send()
+    def run_and_finish_sending(self, coroutine, *players):
+        """Runs the coroutine and waits until the players have sent all the queued messages.
+        Returns the result of the coroutine.
         """
-        websocket = MagicMock()
+        async def run():
+            result = await coroutine
+            for player in players:
+                await player.finish_sending()
+            return result
+
+        return asyncio.run(run())
+
+    def get_mocked_websocket(self, write_buffer_size: int = 0):
+        """Helper method to get a mocked up websocket whose transport has the given write buffer size
+        """
+        websocket = MagicMock(spec=websockets.WebSocketServerProtocol)
+        websocket.transport = MagicMock()
+        websocket.transport.get_write_buffer_size.return_value = write_buffer_size
+        return websocket
+
+    def test_player_send_encoded_json_rpc_request(self):
+        """Tests that Player.send_encoded_json_rpc_request() calls websocket send()
+        """
+        websocket = MagicMock(spec=websockets.WebSocketServerProtocol)
         send = AsyncMock()
-        websocket.attach_mock(send, 'send')
+        websocket.send = send
 
         player = Player(None, websocket)
         string = "Player is " + str([player])
 
-        params = dict()
-        params['a'] = 'x'
-        asyncio.run(player.send_json_rpc_request("general_request", params))
+        self.run_and_finish_sending(player.send_encoded_json_rpc_request(
+            "general_request", '{"a":"x"}'), player)
 
         send.assert_called_once_with(
-            '{"id": 1, "method": "general_request", "params": {"a": "x"}}')
+            '{"id":1,"method":"general_request","params":{"a":"x"}}')
 
-    def test_player_send_json_rpc_request_throws_connection_closed(self):
-        """Tests Player.send_json_rpc_request() when websocket send() throws a ConnectionClosed exception
+    def test_player_send_encoded_json_rpc_request_throws_connection_closed(self):
+        """Tests Player.send_encoded_json_rpc_request() when websocket send() throws a ConnectionClosed exception
         """
-        websocket = MagicMock()
+        websocket = MagicMock(spec=websockets.WebSocketServerProtocol)
         send = AsyncMock(side_effect=ConnectionClosed(0, 'Connection Closed'))
-        websocket.attach_mock(send, 'send')
+        websocket.send = send
 
         player = Player(None, websocket)
         string = "Player is " + str([player])
 
-        params = dict()
-        params['a'] = 'x'
-        asyncio.run(player.send_json_rpc_request("general_request", params))
+        self.run_and_finish_sending(player.send_encoded_json_rpc_request(
+            "general_request", '{"a":"x"}'), player)
         # No exception should propage as expected
         send.assert_called_once()
 
+    def test_player_str(self):
+        """Tests that str() of Player shows the remote address even without a websocket
+        """
+        websocket = MagicMock(spec=websockets.WebSocketServerProtocol)
+        websocket.remote_address = ('127.0.0.1', 50000)
+
+        self.assertEqual(str(Player(None, websocket)),
+                         "Player: [remote=('127.0.0.1', 50000)]")
+        self.assertEqual(str(Player(None, None)), "Player: [remote=None]")
+
+    @patch('hqtrivia.config.CONFIG_TRUST_PROXY_HEADERS', True)
+    def test_player_str_behind_proxy(self):
+        """Tests that str() of Player shows the forwarded client address when the proxy headers are trusted
+        """
+        websocket = MagicMock(spec=websockets.WebSocketServerProtocol)
+        websocket.remote_address = ('127.0.0.1', 50000)
+        websocket.request_headers = {'X-Forwarded-For': '203.0.113.7'}
+
+        self.assertEqual(str(Player(None, websocket)),
+                         "Player: [remote=203.0.113.7]")
+
     def test_player_receive_json_rpc_response(self):
         """Tests that Player.receive_json_rpc_response() calls websocket recv()
         """
-        websocket = MagicMock()
+        websocket = MagicMock(spec=websockets.WebSocketServerProtocol)
         recv = AsyncMock()
         recv.return_value = '{"id":2323, "error":"noerror", "result":"nothing"}'
-        websocket.attach_mock(recv, 'recv')
+        websocket.recv = recv
 
         player = Player(None, websocket)
         (reqid, error, result) = asyncio.run(
@@ -71,9 +112,9 @@ class PlayerTest(unittest.TestCase):
     def test_player_receive_json_rpc_response_connection_closed(self):
         """Tests that Player.receive_json_rpc_response_connection_closed() returns None when websocket throws ConnectionClosed exception
         """
-        websocket = MagicMock()
+        websocket = MagicMock(spec=websockets.WebSocketServerProtocol)
         recv = AsyncMock(side_effect=ConnectionClosed(0, 'Connection Closed'))
-        websocket.attach_mock(recv, 'recv')
+        websocket.recv = recv
 
         player = Player(None, websocket)
         (x, y, z) = asyncio.run(player.receive_json_rpc_response())
@@ -81,14 +122,28 @@ class PlayerTest(unittest.TestCase):
         self.assertEqual(
             (x, y, z), (None, None, None), '(None, None, None) expected for receive_json_rpc_response() when connection is closed')
 
+    def test_player_receive_json_rpc_response_invalid_message(self):
+        """Tests that Player.receive_json_rpc_response() returns None when the message is not a JSON RPC response
+        """
+        for message in ['not a json', '{"id":1, "result":"nothing"}', '["A"]', b'\xff']:
+            websocket = MagicMock(spec=websockets.WebSocketServerProtocol)
+            recv = AsyncMock(return_value=message)
+            websocket.recv = recv
+
+            player = Player(None, websocket)
+            result = asyncio.run(player.receive_json_rpc_response())
+
+            self.assertEqual(result, (None, None, None),
+                             f"(None, None, None) expected for message {message}")
+
     def test_player_receive_json_rpc_response_exception(self):
         """Tests that Player.receive_json_rpc_response_connection_closed() throws Exception when websocket throws Exception
         """
-        websocket = MagicMock()
+        websocket = MagicMock(spec=websockets.WebSocketServerProtocol)
         recv = AsyncMock()
         recv.return_value = "test1"
         recv.side_effect = Exception("System Error")
-        websocket.attach_mock(recv, 'recv')
+        websocket.recv = recv
 
         player = Player(None, websocket)
 
@@ -100,52 +155,247 @@ class PlayerTest(unittest.TestCase):
         """
         question = Question('Question 1', ['A', 'B', 'C', 'D'], 'C')
 
-        websocket = MagicMock()
+        websocket = MagicMock(spec=websockets.WebSocketServerProtocol)
         send = AsyncMock()
-        websocket.attach_mock(send, 'send')
+        websocket.send = send
 
         player = Player(None, websocket)
-        asyncio.run(player.send_question(question))
+        self.assertTrue(self.run_and_finish_sending(
+            player.send_question(question), player))
 
         send.assert_called_once_with(
-            '{"id": 1, "method": "ask_question", "params": {"question": "Question 1", "choices": ["A", "B", "C", "D"]}}')
+            '{"id":1,"method":"ask_question","params":{"question":"Question 1","choices":["A","B","C","D"]}}')
 
-    def test_send_answers(self):
-        """Tests that Player.send_answers() calls websocket send()
+    def test_send_announcement(self):
+        """Tests that Player.send_announcement() calls websocket send()
         """
-        question = Question('Question 1', ['A', 'B', 'C', 'D'], 'C')
-
-        websocket = MagicMock()
+        websocket = MagicMock(spec=websockets.WebSocketServerProtocol)
         send = AsyncMock()
-        websocket.attach_mock(send, 'send')
+        websocket.send = send
 
         player = Player(None, websocket)
-        counts = [1, 0, 1, 0]
-        asyncio.run(player.send_answers(question, counts))
+        self.run_and_finish_sending(player.send_announcement("Breaking News!!!"), player)
 
         send.assert_called_once_with(
-            '{"id": 1, "method": "answers", "params": {"question": {"question": "Question 1", "choices": ["A", "B", "C", "D"], "answer": "C"}, "choice_counts": [1, 0, 1, 0]}}')
+            '{"id":1,"method":"announcement","params":{"message":"Breaking News!!!"}}')
 
-    def test_send_announcement(self):
-        """Tests that Player.send_announcement() calls websocket send()
+    def test_send_announcement_static_message(self):
+        """Tests that Player.send_announcement() sends the fixed messages the same way
         """
-        websocket = MagicMock()
+        websocket = MagicMock(spec=websockets.WebSocketServerProtocol)
         send = AsyncMock()
-        websocket.attach_mock(send, 'send')
+        websocket.send = send
 
         player = Player(None, websocket)
-        asyncio.run(player.send_announcement("Breaking News!!!"))
+        self.run_and_finish_sending(player.send_announcement(MESSAGE_YOU_ARE_THE_WINNER), player)
 
         send.assert_called_once_with(
-            '{"id": 1, "method": "announcement", "params": {"message": "Breaking News!!!"}}')
+            '{"id":1,"method":"announcement","params":{"message":"Congratulations, you are the winner!"}}')
+
+    def test_encode_announcement_params_cached(self):
+        """Tests that encode_announcement_params() encodes the same announcement only once
+        """
+        message = TEMPLATE_GAME_ROUND_STARTING.substitute(round=7)
+
+        params_json = encode_announcement_params(message)
+
+        self.assertEqual(params_json, '{"message":"Game round 7 starting."}')
+        self.assertIs(params_json, encode_announcement_params(
+            TEMPLATE_GAME_ROUND_STARTING.substitute(round=7)), "JSON text must be cached")
+
+    @patch('hqtrivia.player.websockets_broadcast', new_callable=MagicMock)
+    def test_broadcast_round_result(self, websockets_broadcast):
+        """Tests that Player.broadcast_round_result() calls websockets broadcast() once for all players
+        """
+        question = Question('Question 1', ['A', 'B', 'C', 'D'], 'C')
+
+        websocket1 = self.get_mocked_websocket()
+        websocket2 = self.get_mocked_websocket()
+        players = [Player(None, websocket1), Player(None, websocket2)]
+
+        asyncio.run(Player.broadcast_round_result(
+            players, question, [0, 0, 2, 0], MESSAGE_CORRECT_ANSWER))
+
+        websockets_broadcast.assert_called_once_with(
+            [websocket1, websocket2],
+            '{"id":null,"method":"round_result","params":{"question":{"question":"Question 1","choices":["A","B","C","D"],"answer":"C"},"choice_counts":[0,0,2,0],"message":"You answered correctly!"}}')
+
+    @patch('hqtrivia.player.websockets_broadcast', None)
+    def test_broadcast_announcement_without_websockets_broadcast(self):
+        """Tests that Player.broadcast_announcement() calls websocket send() on each player if websockets has no broadcast()
+        """
+        websocket1 = MagicMock(spec=websockets.WebSocketServerProtocol)
+        send1 = AsyncMock(
+            side_effect=ConnectionClosed(0, 'Connection Closed'))
+        websocket1.send = send1
+
+        websocket2 = MagicMock(spec=websockets.WebSocketServerProtocol)
+        send2 = AsyncMock()
+        websocket2.send = send2
+
+        players = [Player(None, websocket1), Player(None, websocket2)]
+
+        self.run_and_finish_sending(Player.broadcast_announcement(
+            players, MESSAGE_NETWORK_ERROR_OCCURRED), *players)
+
+        expected = '{"id":null,"method":"announcement","params":{"message":"Network error encountered. Please try again later."}}'
+        send1.assert_called_once_with(expected)
+        send2.assert_called_once_with(expected)
+
+    @patch('hqtrivia.player.websockets_broadcast', None)
+    def test_broadcast_announcement_without_websockets_broadcast_throws_exception(self):
+        """Tests that Player.broadcast_announcement() sends to every player and logs an unexpected exception
+        """
+        websocket1 = MagicMock(spec=websockets.WebSocketServerProtocol)
+        send1 = AsyncMock(side_effect=TypeError('Bug'))
+        websocket1.send = send1
+
+        websocket2 = MagicMock(spec=websockets.WebSocketServerProtocol)
+        send2 = AsyncMock()
+        websocket2.send = send2
+
+        players = [Player(None, websocket1), Player(None, websocket2)]
+
+        with self.assertLogs(level='ERROR'):
+            self.run_and_finish_sending(Player.broadcast_announcement(
+                players, MESSAGE_NETWORK_ERROR_OCCURRED), *players)
+
+        send1.assert_called_once()
+        send2.assert_called_once()
+
+    @patch('hqtrivia.player.websockets_broadcast', new_callable=MagicMock)
+    def test_broadcast_announcement_keeps_order_with_queued_messages(self, websockets_broadcast):
+        """Tests that Player.broadcast_announcement() queues the message for the player who has unsent messages
+        """
+        websocket1 = self.get_mocked_websocket()
+        send1 = AsyncMock()
+        websocket1.send = send1
+
+        websocket2 = self.get_mocked_websocket()
+        players = [Player(None, websocket1), Player(None, websocket2)]
+
+        async def run():
+            await players[0].send_announcement("First")
+            await Player.broadcast_announcement(players, "Second")
+            await players[0].finish_sending()
+
+        asyncio.run(run())
+
+        websockets_broadcast.assert_called_once_with(
+            [websocket2], '{"id":null,"method":"announcement","params":{"message":"Second"}}')
+        # Both were queued before the writer got to run, so they are sent together in order
+        send1.assert_called_once_with(
+            '[{"id":1,"method":"announcement","params":{"message":"First"}},{"id":null,"method":"announcement","params":{"message":"Second"}}]')
+
+    @patch('hqtrivia.player.websockets_broadcast', new_callable=MagicMock)
+    def test_broadcast_announcement_queues_for_slow_connection(self, websockets_broadcast):
+        """Tests that Player.broadcast_announcement() queues the message for the player whose websocket has not written out everything
+        """
+        websocket1 = self.get_mocked_websocket(write_buffer_size=100)
+        send1 = AsyncMock()
+        websocket1.send = send1
+
+        websocket2 = self.get_mocked_websocket()
+        players = [Player(None, websocket1), Player(None, websocket2)]
+
+        self.run_and_finish_sending(
+            Player.broadcast_announcement(players, "Hello"), *players)
+
+        expected = '{"id":null,"method":"announcement","params":{"message":"Hello"}}'
+        websockets_broadcast.assert_called_once_with([websocket2], expected)
+        # Going through the queue keeps the slow player under the queue limit
+        send1.assert_called_once_with(expected)
+
+    @patch('hqtrivia.player.MAX_MESSAGES_PER_FRAME', 2)
+    def test_send_messages_queued_together_limit(self):
+        """Tests that no more than MAX_MESSAGES_PER_FRAME messages are sent in one frame
+        """
+        websocket = MagicMock(spec=websockets.WebSocketServerProtocol)
+        send = AsyncMock()
+        websocket.send = send
+
+        player = Player(None, websocket)
+
+        async def run():
+            for message in ["First", "Second", "Third"]:
+                await player.send_announcement(message)
+            await player.finish_sending()
+
+        asyncio.run(run())
+
+        send.assert_has_calls([
+            call('[{"id":1,"method":"announcement","params":{"message":"First"}},{"id":2,"method":"announcement","params":{"message":"Second"}}]'),
+            call('{"id":3,"method":"announcement","params":{"message":"Third"}}')])
+        self.assertEqual(send.call_count, 2)
+
+    def test_send_messages_queued_together(self):
+        """Tests that messages queued while the previous one is being written are sent in one frame
+        """
+        websocket = MagicMock(spec=websockets.WebSocketServerProtocol)
+        send = AsyncMock()
+        websocket.send = send
+
+        player = Player(None, websocket)
+
+        async def run():
+            await player.send_announcement("First")
+            # Let the writer start writing the first message
+            await asyncio.sleep(0)
+            await player.send_announcement("Second")
+            await player.send_announcement("Third")
+            await player.finish_sending()
+
+        asyncio.run(run())
+
+        send.assert_has_calls([
+            call('{"id":1,"method":"announcement","params":{"message":"First"}}'),
+            call('[{"id":2,"method":"announcement","params":{"message":"Second"}},{"id":3,"method":"announcement","params":{"message":"Third"}}]')])
+        self.assertEqual(send.call_count, 2)
+
+    @patch('hqtrivia.player.MAX_QUEUED_MESSAGES', 1)
+    def test_send_evicts_player_when_queue_is_full(self):
+        """Tests that the player is disconnected instead of skipping a message when too many messages are queued
+        """
+        websocket = MagicMock(spec=websockets.WebSocketServerProtocol)
+        send = AsyncMock()
+        websocket.send = send
+        close = AsyncMock()
+        websocket.close = close
+
+        player = Player(None, websocket)
+
+        async def run():
+            # The writer does not get to run in between, so the second message does not fit
+            self.assertTrue(await player.send_json_string('"First"'))
+            self.assertFalse(await player.send_json_string('"Second"'))
+            # Nothing is queued for the evicted player any more
+            self.assertFalse(await player.send_question(
+                Question('Question 1', ['A', 'B', 'C', 'D'], 'C')))
+            await player.close_task
+            await player.finish_sending()
+
+        asyncio.run(run())
+
+        self.assertTrue(player.evicted)
+        self.assertIsNone(player.writer_task)
+        close.assert_called_once()
+        send.assert_not_called()
+
+    def test_finish_sending_without_messages(self):
+        """Tests that Player.finish_sending() returns right away if nothing was ever sent
+        """
+        player = Player(None, MagicMock(spec=websockets.WebSocketServerProtocol))
+        asyncio.run(player.finish_sending())
+
+        self.assertIsNone(player.writer_task)
 
     def test_player_recv_answer(self):
         """Tests that Player.recv_answer() calls websocket recv()
         """
-        websocket = MagicMock()
+        websocket = MagicMock(spec=websockets.WebSocketServerProtocol)
         recv = AsyncMock()
         recv.return_value = '{"id":2323, "error":"noerror", "result":"nothing"}'
-        websocket.attach_mock(recv, 'recv')
+        websocket.recv = recv
 
         player = Player(None, websocket)
         answer = asyncio.run(player.recv_answer())
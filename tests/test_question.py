@@ -1,13 +1,18 @@
 import aiohttp
 import asyncio
 import logging
+import os
 import unittest
 from unittest.mock import AsyncMock
+from unittest.mock import MagicMock
 from unittest.mock import patch
 
 import hqtrivia.config as config
 from hqtrivia.question import Question
+from hqtrivia.question import QuestionPool
 
+# Tests that talk to the real Trivia server only run when this environment variable is set.
+NETWORK_TESTS = os.environ.get('HQTRIVIA_NETWORK_TESTS')
 
 class QuestionTest(unittest.TestCase):
 
@@ -17,6 +22,7 @@ class QuestionTest(unittest.TestCase):
     def tearDown(self):
         pass
 
+    @unittest.skipUnless(NETWORK_TESTS, "set HQTRIVIA_NETWORK_TESTS=1 to run the network tests")
     def test_question(self):
         """Test the actual question retrieval and checks the validity of the Question instance.
         """
@@ -46,13 +52,160 @@ class QuestionTest(unittest.TestCase):
         """Test when the HTTP GET returns 400 from the Trivia server
         """
 
-        # Point to a server that always returns 400
-        self.backup_api = config.CONFIG_QUESTION_GENERATOR_API
-        config.CONFIG_QUESTION_GENERATOR_API = 'http://httpbin.org/status/400'
+        response = MagicMock()
+        response.status = 400
 
-        try:
-            with self.assertRaises(Exception):
-                asyncio.run(Question.generate())
+        session = MagicMock()
+        session.get.return_value.__aenter__ = AsyncMock(return_value=response)
+        session.get.return_value.__aexit__ = AsyncMock(return_value=False)
 
-        finally:
-            config.CONFIG_QUESTION_GENERATOR_API = self.backup_api
+        with self.assertRaises(Exception):
+            asyncio.run(Question.generate(session))
+
+        response.read.assert_not_called()
+
+    def test_question_with_session(self):
+        """Tests that generate() sends the request through the given session and parses the response.
+        """
+        response = MagicMock()
+        response.status = 200
+        response.read = AsyncMock(
+            return_value=b'{"response_code": 0, "results": [{"question": "Q?", "correct_answer": "C", "incorrect_answers": ["A", "B", "D"]}]}')
+
+        session = MagicMock()
+        session.get.return_value.__aenter__ = AsyncMock(return_value=response)
+        session.get.return_value.__aexit__ = AsyncMock(return_value=False)
+
+        with patch.object(config, 'CONFIG_QUESTION_GENERATOR_API', 'http://localhost/api.php?amount=10&type=multiple'):
+            question = asyncio.run(Question.generate(session))
+
+        # Only one question is requested regardless of the configured amount
+        session.get.assert_called_once_with(
+            'http://localhost/api.php?amount=1&type=multiple')
+        self.assertEqual(question.question, 'Q?')
+        self.assertEqual(question.answer, 'C')
+        self.assertEqual(sorted(question.choices), ['A', 'B', 'C', 'D'])
+
+    def test_get_json_without_answer(self):
+        """Tests that get_json_without_answer() leaves out the answer and caches the JSON text.
+        """
+        question = Question('Question 1', ['A', 'B', 'C', 'D'], 'C')
+
+        json_text = question.get_json_without_answer()
+
+        self.assertEqual(
+            json_text, '{"question":"Question 1","choices":["A","B","C","D"]}')
+        self.assertIs(json_text, question.get_json_without_answer(),
+                      "JSON text must be cached")
+
+    def test_get_json(self):
+        """Tests that get_json() includes the answer and caches the JSON text.
+        """
+        question = Question('Question 1', ['A', 'B', 'C', 'D'], 'C')
+
+        json_text = question.get_json()
+
+        self.assertEqual(
+            json_text, '{"question":"Question 1","choices":["A","B","C","D"],"answer":"C"}')
+        self.assertIs(json_text, question.get_json(),
+                      "JSON text must be cached")
+
+    def test_question_has_no_instance_dict(self):
+        """Tests that Question uses __slots__ instead of the per instance __dict__
+        """
+        question = Question('Question 1', ['A', 'B', 'C', 'D'], 'C')
+
+        self.assertFalse(hasattr(question, '__dict__'))
+        self.assertEqual(str(question), str(
+            {'question': 'Question 1', 'choices': ['A', 'B', 'C', 'D'], 'answer': 'C'}))
+
+    def test_question_generate_many_without_results(self):
+        """Tests that generate_many() throws an exception when the server returns no questions.
+        """
+        response = MagicMock()
+        response.status = 200
+        response.read = AsyncMock(
+            return_value=b'{"response_code": 5, "results": []}')
+
+        session = MagicMock()
+        session.get.return_value.__aenter__ = AsyncMock(return_value=response)
+        session.get.return_value.__aexit__ = AsyncMock(return_value=False)
+
+        with self.assertRaises(Exception):
+            asyncio.run(Question.generate_many(session))
+
+        # The configured API is used as is when no amount is given
+        session.get.assert_called_once_with(
+            config.CONFIG_QUESTION_GENERATOR_API)
+
+    @patch('hqtrivia.question.Question.generate_many', new_callable=AsyncMock)
+    def test_question_pool_get(self, generate_many):
+        """Tests that QuestionPool.get() hands out all the generated questions before generating again.
+        """
+        question1 = Question('Question 1', ['A', 'B', 'C', 'D'], 'C')
+        question2 = Question('Question 2', ['A', 'B', 'C', 'D'], 'A')
+        question3 = Question('Question 3', ['A', 'B', 'C', 'D'], 'B')
+        generate_many.side_effect = [[question1, question2], [question3]]
+
+        session = MagicMock()
+        pool = QuestionPool(session)
+
+        async def my_coroutine():
+            return [await pool.get(), await pool.get(), await pool.get()]
+
+        questions = asyncio.run(my_coroutine())
+
+        self.assertEqual(questions, [question1, question2, question3])
+        self.assertEqual(generate_many.call_count, 2)
+        generate_many.assert_called_with(session)
+
+    @patch('hqtrivia.question.Question.generate_many', new_callable=AsyncMock)
+    def test_question_pool_get_shares_request(self, generate_many):
+        """Tests that concurrent QuestionPool.get() calls share a single request.
+        """
+        question1 = Question('Question 1', ['A', 'B', 'C', 'D'], 'C')
+        question2 = Question('Question 2', ['A', 'B', 'C', 'D'], 'A')
+        generate_many.return_value = [question1, question2]
+
+        pool = QuestionPool()
+
+        async def my_coroutine():
+            return await asyncio.gather(pool.get(), pool.get())
+
+        questions = asyncio.run(my_coroutine())
+
+        self.assertEqual(questions, [question1, question2])
+        generate_many.assert_called_once()
+
+    @patch('hqtrivia.question.Question.generate_many', new_callable=AsyncMock)
+    def test_question_pool_put_back(self, generate_many):
+        """Tests that the question put back to QuestionPool is handed out next without generating again.
+        """
+        question1 = Question('Question 1', ['A', 'B', 'C', 'D'], 'C')
+        question2 = Question('Question 2', ['A', 'B', 'C', 'D'], 'A')
+        generate_many.return_value = [question1, question2]
+
+        pool = QuestionPool()
+
+        async def my_coroutine():
+            question = await pool.get()
+            pool.put_back(question)
+            return [await pool.get(), await pool.get()]
+
+        questions = asyncio.run(my_coroutine())
+
+        self.assertEqual(questions, [question1, question2])
+        generate_many.assert_called_once()
+
+    @patch('hqtrivia.question.Question.generate_many', new_callable=AsyncMock)
+    def test_question_pool_get_exception(self, generate_many):
+        """Tests that QuestionPool.get() throws the exception from the question generation.
+        """
+        generate_many.side_effect = Exception("Network Error!!!")
+
+        pool = QuestionPool()
+
+        with self.assertRaises(Exception):
+            asyncio.run(pool.get())
+
+        self.assertIsNone(pool.fetch_task)
@@ -7,6 +7,8 @@ from unittest.mock import Mock
 from unittest.mock import patch
 import websockets
 
+import hqtrivia.config as config
+from hqtrivia.websocketserver import get_client_address
 from hqtrivia.websocketserver import WebsocketServer
 from hqtrivia.websocketserver import WebsocketCallbackInterface
 
@@ -22,7 +24,9 @@ class WebsocketServerTest(unittest.TestCase):
 
         wss.start()
 
-        serve.assert_called_once_with(wss.ws_handler_impl, port=64823)
+        serve.assert_called_once_with(
+            wss.ws_handler_impl, port=64823, compression=None, max_size=2 ** 13,
+            read_limit=2 ** 13, write_limit=2 ** 13)
 
     def test_ws_handler_impl(self):
         """Tests whether ws_handler_impl() calls callback with correct arguments
@@ -31,7 +35,7 @@ class WebsocketServerTest(unittest.TestCase):
         callback = MagicMock()
         wss = WebsocketServer(64823, callback)
         handle_new_websocket = AsyncMock()
-        wss.callback.attach_mock(handle_new_websocket, 'handle_new_websocket')
+        wss.callback.handle_new_websocket = handle_new_websocket
 
         ws = MagicMock()
 
@@ -53,10 +57,26 @@ class WebsocketServerTest(unittest.TestCase):
         wss = WebsocketServer(64823, callback)
         handle_new_websocket = AsyncMock(
             side_effect=Exception("Error Occurred"))
-        wss.callback.attach_mock(handle_new_websocket, 'handle_new_websocket')
+        wss.callback.handle_new_websocket = handle_new_websocket
 
         ws = MagicMock()
 
         asyncio.run(wss.ws_handler_impl(ws, None))
 
         handle_new_websocket.assert_called_once_with(ws)
+
+    def test_get_client_address(self):
+        """Tests that get_client_address() only uses X-Forwarded-For when proxy headers are trusted
+        """
+        ws = MagicMock()
+        ws.remote_address = ('127.0.0.1', 50000)
+        ws.request_headers = {'X-Forwarded-For': '10.0.0.1, 192.168.0.1'}
+
+        self.assertEqual(get_client_address(ws), ('127.0.0.1', 50000))
+
+        with patch('hqtrivia.config.CONFIG_TRUST_PROXY_HEADERS', True):
+            # Address appended by the proxy is used, not the one sent by the client
+            self.assertEqual(get_client_address(ws), '192.168.0.1')
+
+            ws.request_headers = {}
+            self.assertEqual(get_client_address(ws), ('127.0.0.1', 50000))